@@ -0,0 +1,168 @@
+"""Admission control for scrape jobs: a bounded priority queue and per-client token buckets."""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+
+from config import QUEUE_MAX_SIZE, QUEUE_WORKERS, RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST
+
+# Lower runs first
+PRIORITY_KEYWORD = 0    # saved users sending their keyword
+PRIORITY_CHECK = 1      # /check and /plan with credentials
+PRIORITY_API = 2        # POST /attendance, /plan
+PRIORITY_BACKGROUND = 3 # batches, prefetch, notifications, stale refreshes
+
+PRIORITY_NAMES = {
+    PRIORITY_KEYWORD: "keyword",
+    PRIORITY_CHECK: "check",
+    PRIORITY_API: "api",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class Overloaded(Exception):
+    """Request refused; the caller may retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class QueueFull(Overloaded):
+    pass
+
+
+class RateLimited(Overloaded):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0, or the seconds until one is available (nothing taken)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """One token bucket per client key ("tg:<user id>", "ip:<address>"), least recently used dropped"""
+
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST, max_clients: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def check(self, client: str):
+        """Raise RateLimited if ``client`` is over its budget"""
+        if not client or self.rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        wait = bucket.take()
+        if wait:
+            raise RateLimited("Too many requests", wait)
+
+
+class PriorityJobQueue:
+    """Bounded replacement for asyncio.Queue ordered by (priority, arrival)
+
+    Jobs need a mutable ``priority`` attribute; ``promote`` moves a waiting job to
+    a more urgent class (e.g. a keyword user joining a background refresh).
+    """
+
+    def __init__(self, maxsize: int = QUEUE_MAX_SIZE, workers: int = QUEUE_WORKERS):
+        self.maxsize = maxsize
+        self.workers = max(1, workers)
+        self._heap = []
+        self._waiting = {}  # id(job) -> heap key currently valid for it
+        self._seq = itertools.count()
+        self._getters = []
+        self._avg_job_seconds = 5.0
+
+    def qsize(self) -> int:
+        return len(self._waiting)
+
+    def empty(self) -> bool:
+        return not self._waiting
+
+    def retry_after(self) -> float:
+        """Rough time for the workers to work through the current backlog"""
+        return self.qsize() / self.workers * self._avg_job_seconds
+
+    def record_job_time(self, seconds: float):
+        self._avg_job_seconds += 0.2 * (seconds - self._avg_job_seconds)
+
+    def put_nowait(self, job, priority: int = None):
+        if self.maxsize and self.qsize() >= self.maxsize:
+            raise QueueFull("The queue is full", self.retry_after())
+        if priority is not None:
+            job.priority = priority
+        self._push(job)
+
+    def _push(self, job):
+        key = (job.priority, next(self._seq))
+        self._waiting[id(job)] = key
+        heapq.heappush(self._heap, (key, job))
+        self._wakeup_next()
+
+    def _wakeup_next(self):
+        while self._getters:
+            getter = self._getters.pop(0)
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    def promote(self, job, priority: int):
+        """Move a still-waiting job to a more urgent class; no-op otherwise"""
+        if id(job) in self._waiting and priority < job.priority:
+            job.priority = priority
+            self._push(job)  # the old heap entry is now stale and skipped by get()
+
+    def position(self, job):
+        """1-based place in line, or None once a worker has taken the job"""
+        key = self._waiting.get(id(job))
+        if key is None:
+            return None
+        return 1 + sum(other < key for other in self._waiting.values())
+
+    def get_nowait(self):
+        while self._heap:
+            key, job = heapq.heappop(self._heap)
+            if self._waiting.get(id(job)) == key:
+                del self._waiting[id(job)]
+                return job
+        raise asyncio.QueueEmpty
+
+    async def get(self):
+        while self.empty():
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                getter.cancel()
+                if getter in self._getters:
+                    self._getters.remove(getter)
+                elif not self.empty():
+                    # We were woken for a job we won't take; pass it on
+                    self._wakeup_next()
+                raise
+        return self.get_nowait()
@@ -1,14 +1,16 @@
+import hmac
 import json
 import logging
 import asyncio
+import time
 from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 import threading
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-import uvicorn
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from telegram import Update
 from telegram.ext import (
@@ -19,7 +21,47 @@ from telegram.ext import (
     CallbackContext,
 )
 from scrapper import get_attendance_report
-from model import init_db, save_user, get_user
+from browser_pool import browser_pool
+from resource_governor import resource_governor
+from http_engine import http_engine
+from session_store import session_store, credential_digest
+from report_cache import report_cache, mark_cached
+from planner import plan_attendance
+from history import history_store
+import metrics
+from config import (
+    QUEUE_WORKERS, JOB_TIMEOUT, SCRAPER_ENGINE, ATTENDANCE_THRESHOLD, PLAN_MAX_CLASSES,
+    BATCH_CONCURRENCY, BATCH_MAX_ACCOUNTS, TELEGRAM_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    BOT_CONCURRENT_UPDATES,
+    QUEUE_BACKEND, JOB_DEADLINE,
+)
+from model import (
+    init_db,
+    close_db,
+    save_user_async,
+    find_user,
+    is_keyword_async,
+    keyword_index,
+    load_keyword_index_async,
+    record_activity_async,
+    set_notify_async,
+    save_notify_state_async,
+)
+from scheduler import Prefetcher
+from job_queue import durable_queue
+from portal_health import portal_health, PortalUnavailable, portal_error, is_portal_error
+from admission import (
+    PriorityJobQueue,
+    RateLimiter,
+    Overloaded,
+    QueueFull,
+    PRIORITY_KEYWORD,
+    PRIORITY_CHECK,
+    PRIORITY_API,
+    PRIORITY_BACKGROUND,
+    PRIORITY_NAMES,
+)
+from notifier import Notifier, content_hash
 
 # Comprehensive MarkdownV2 escaping dictionary
 MARKDOWN_ESCAPE_TABLE = str.maketrans({
@@ -30,6 +72,25 @@ MARKDOWN_ESCAPE_TABLE = str.maketrans({
     '.': '\\.', '!': '\\!', '%': '\\%'
 })
 
+# Trailing word on /check or a keyword that skips the report cache
+FRESH_KEYWORD = "fresh"
+
+# Upcoming classes /plan shows when none are given, and the cap for POST /plan
+PLAN_DEFAULT_CLASSES = 5
+PLAN_CLASSES_LIMIT = 500
+
+# Seconds between queue-position updates on a waiting user's status message
+QUEUE_POSITION_INTERVAL = 2
+
+# Seconds between checks whether an API client has gone away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+EXPIRED_ERROR = "The request timed out. Please try again."
+
+# Window /trend looks back over when no weeks are given, and its cap
+TREND_DEFAULT_WEEKS = 4
+TREND_MAX_WEEKS = 52
+
 # Thread pool for blocking operations
 executor = ThreadPoolExecutor(max_workers=3)
 
@@ -78,12 +139,224 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = "Add your token here"
-bot_app = Application.builder().token(TELEGRAM_TOKEN).build()
+# Handlers wait for their scrape, so updates must run concurrently (PTB defaults to one at a time)
+bot_app = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(max(1, BOT_CONCURRENT_UPDATES)).build()
+
+def init_storage():
+    """Create/migrate the SQLite tables; run at startup rather than on import"""
+    init_db()
+    history_store.init()
+    report_cache.init()
+
+@dataclass
+class Job:
+    """One queued scrape; ``future`` receives the report JSON
+
+    Cancelling ``future`` is the job's cancellation token: a queued job is then
+    skipped and a running one aborted. ``deadline`` (time.monotonic) is when
+    everyone waiting will have given up.
+    """
+    username: str
+    password: str
+    future: asyncio.Future
+    priority: int = PRIORITY_BACKGROUND
+    enqueued_at: float = field(default_factory=time.monotonic)
+    deadline: float = None
+    # fetch_report callers currently awaiting the result
+    waiters: int = 0
+    # The result is wanted even with no waiters (cache refresh, prefetch, notifications)
+    detached: bool = True
+
+    def __post_init__(self):
+        if self.deadline is None:
+            self.deadline = self.enqueued_at + JOB_DEADLINE
+
+# Bounded, priority-ordered queue of attendance requests
+request_queue = PriorityJobQueue()
+# Per-client budget for requests that need a scrape
+rate_limiter = RateLimiter()
+
+QUEUE_DEPTH = metrics.Gauge("queue_depth", "Jobs waiting in request_queue", fn=request_queue.qsize)
+JOBS_IN_FLIGHT = metrics.Gauge("jobs_in_flight", "Jobs currently being scraped by queue workers")
+QUEUE_WAIT_SECONDS = metrics.Histogram("queue_wait_seconds", "Time a job waited in request_queue before a worker took it, by priority")
+JOB_SECONDS = metrics.Histogram("job_seconds", "Time a queue worker spent on one job, by outcome")
+
+# username -> (credential digest, job) for the scrape currently queued or running
+inflight_requests = {}
+
+def queue_scrape(username: str, password: str, priority: int = PRIORITY_BACKGROUND,
+                 deadline: float = None, detached: bool = True) -> Job:
+    """Queue a scrape, or return the job already in flight for the same credentials
+
+    ``detached`` jobs run to completion even if nobody awaits them; others are
+    cancelled by fetch_report once their last waiter leaves. Raises QueueFull
+    when the queue is at QUEUE_MAX_SIZE.
+    """
+    digest = credential_digest(username, password)
+    entry = inflight_requests.get(username)
+    if entry is not None and entry[0] == digest and not entry[1].future.done():
+        job = entry[1]
+        metrics.inc("coalesced_requests")
+        request_queue.promote(job, priority)
+        job.detached = job.detached or detached
+        if deadline is not None:
+            job.deadline = max(job.deadline, deadline)
+        return job
+
+    job = Job(username, password, asyncio.get_running_loop().create_future(), priority,
+              deadline=deadline, detached=detached)
+    try:
+        request_queue.put_nowait(job)
+    except QueueFull:
+        metrics.inc("rejected_queue_full")
+        raise
+    inflight_requests[username] = (digest, job)
+    future = job.future
+
+    def on_done(_):
+        if inflight_requests.get(username, (None, None))[1] is job:
+            del inflight_requests[username]
+        if not future.cancelled() and future.exception() is None:
+            report_cache.put(username, password, future.result())
+
+    future.add_done_callback(on_done)
+    metrics.inc("queued_requests")
+    return job
+
+def refresh_report(username: str, password: str) -> asyncio.Future:
+    """Background refresh (prefetch, notifications): queue a detached scrape, return its future"""
+    return queue_scrape(username, password).future
+
+def queue_position(username: str):
+    """1-based place in line of ``username``'s queued scrape, or None if none is waiting"""
+    entry = inflight_requests.get(username)
+    return request_queue.position(entry[1]) if entry is not None else None
+
+async def fetch_report(username: str, password: str, fresh: bool = False,
+                       priority: int = PRIORITY_API, client: str = None, deadline: float = None) -> str:
+    """Serve from the report cache when possible, otherwise wait for a (coalesced) scrape
 
-init_db()
+    Stale reports are returned immediately while a refresh runs in the background;
+    ``fresh`` skips the cache entirely. Scrapes count against ``client``'s rate
+    limit; Overloaded (RateLimited / QueueFull) is raised when they can't be queued.
+    While the portal circuit is open nothing is queued: the last known report is
+    served if there is one, otherwise an error right away.
 
-# Use an asyncio.Queue for attendance requests
-request_queue = asyncio.Queue()
+    Waiting stops at ``deadline`` (time.monotonic, default JOB_DEADLINE from now);
+    when the last waiter leaves, by deadline or cancellation, the scrape is cancelled.
+    """
+    portal_down = portal_health.breaker.is_open()
+    if not fresh or portal_down:
+        cached = await report_cache.get_async(username, password)
+        if cached is not None:
+            report_json, fetched_at, is_fresh = cached
+            if is_fresh:
+                metrics.inc("report_cache_hits")
+            else:
+                metrics.inc("report_cache_stale_hits")
+                # Refresh in the background; the cache is updated when it completes
+                try:
+                    if not portal_down:
+                        queue_scrape(username, password, detached=True)
+                except QueueFull:
+                    pass
+            return mark_cached(report_json, fetched_at)
+        metrics.inc("report_cache_misses")
+    if portal_down:
+        return portal_error(PortalUnavailable(portal_health.breaker.retry_after()))
+
+    try:
+        rate_limiter.check(client)
+    except Overloaded:
+        metrics.inc("rejected_rate_limited")
+        raise
+    deadline = deadline or time.monotonic() + JOB_DEADLINE
+    job = queue_scrape(username, password, priority, deadline=deadline, detached=False)
+    job.waiters += 1
+    try:
+        # Shield so one impatient waiter can't cancel the job for everyone else
+        report_json = await asyncio.wait_for(asyncio.shield(job.future), timeout=max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        metrics.inc("deadline_exceeded")
+        return json.dumps({"error": EXPIRED_ERROR})
+    finally:
+        job.waiters -= 1
+        if not job.waiters and not job.detached and not job.future.done():
+            # Nobody wants this result any more; drop it from the queue or abort it
+            job.future.cancel()
+            metrics.inc("jobs_abandoned")
+
+    if is_portal_error(json.loads(report_json)):
+        # The portal failed this scrape: the last known report beats an error
+        cached = await report_cache.get_async(username, password)
+        if cached is not None:
+            metrics.inc("report_cache_stale_hits")
+            return mark_cached(cached[0], cached[1])
+    return report_json
+
+async def fetch_report_with_position(status_msg, username: str, password: str, fresh: bool = False,
+                                     priority: int = PRIORITY_KEYWORD, client: str = None) -> str:
+    """fetch_report for a bot user, showing their place in the queue on ``status_msg`` while they wait"""
+    task = asyncio.ensure_future(fetch_report(username, password, fresh, priority, client))
+    shown = None
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=QUEUE_POSITION_INTERVAL)
+            if done:
+                return task.result()
+            position = queue_position(username)
+            if position is not None and position != shown:
+                shown = position
+                try:
+                    await status_msg.edit_text(f"⏳ *Position {position} in queue\\.\\.\\.*", parse_mode="MarkdownV2")
+                except Exception as e:
+                    logger.debug(f"Queue position update failed: {e}")
+    finally:
+        task.cancel()
+
+def overloaded_text(error: Overloaded) -> str:
+    return f"⏳ *Busy*\n\n_Too many requests right now\\. Please try again in {error.retry_after}s\\._"
+
+async def stream_batch(accounts: list, fresh: bool = False, concurrency: int = BATCH_CONCURRENCY):
+    """Yield one NDJSON line per account in completion order
+
+    At most ``concurrency`` accounts of the batch wait on the queue at a time, so
+    one section can't crowd out live users, and a slow account only delays itself.
+    The caller's rate limit is charged once for the whole batch by the route;
+    accounts the queue can't admit come back "rejected" with ``retry_after``.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index, account):
+        username, password = account.get("username"), account.get("password")
+        item = {"index": index, "username": username}
+        if not username or not password:
+            return {**item, "status": "invalid", "error": "Missing username or password", "elapsed_ms": 0}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                report = json.loads(await fetch_report(
+                    username, password, fresh=fresh, priority=PRIORITY_BACKGROUND
+                ))
+            except Overloaded as e:
+                return {**item, "status": "rejected", "error": str(e), "retry_after": e.retry_after, "elapsed_ms": 0}
+            except Exception as e:
+                report = {"error": str(e) or type(e).__name__}
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        if "error" in report:
+            return {**item, "status": "error", "error": report["error"], "elapsed_ms": elapsed_ms}
+        return {**item, "status": "ok", "cached": "cached_at" in report, "elapsed_ms": elapsed_ms, "report": report}
+
+    tasks = [asyncio.create_task(run(i, account)) for i, account in enumerate(accounts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            metrics.inc(f"batch_items_{item['status']}")
+            yield json.dumps(item) + "\n"
+    finally:
+        # Client went away: stop waiting, which cancels scrapes nobody else is waiting for
+        for task in tasks:
+            task.cancel()
 
 # -------------------------------
 # Telegram Command and Message Handlers
@@ -96,7 +369,14 @@ async def start(update: Update, context: CallbackContext):
         "2️⃣ One\\-time check:\n"
         "`/check username password`\n\n"
         "3️⃣ Quick access:\n"
-        "Send your saved keyword"
+        "Send your saved keyword\n\n"
+        "4️⃣ What\\-if planner:\n"
+        "`/plan [classes]`\n\n"
+        "5️⃣ Trends from past checks:\n"
+        "`/trend [weeks]`\n\n"
+        "6️⃣ Get a message when new marks are posted:\n"
+        "`/notify on` or `/notify off`\n\n"
+        "Reports are cached for a while; add `fresh` \\(e\\.g\\. `keyword fresh`\\) for a live check"
     )
     await update.message.reply_text(msg, parse_mode="MarkdownV2")
 
@@ -109,7 +389,7 @@ async def set_credentials(update: Update, context: CallbackContext):
         return
     username, password, keyword = context.args
     user_id = str(update.effective_user.id)
-    save_user(user_id, username, password, keyword.lower())
+    await save_user_async(user_id, username, password, keyword.lower())
     # Escape the exclamation mark by adding a backslash
     await update.message.reply_text(
         f"✅ Account Setup Successful\\! Your keyword: `{keyword}`", 
@@ -118,9 +398,11 @@ async def set_credentials(update: Update, context: CallbackContext):
     logger.info(f"Saved credentials for user {user_id}")
    
 async def check_attendance(update: Update, context: CallbackContext):
-    if len(context.args) != 2:
+    args = context.args
+    fresh = len(args) == 3 and args[2].lower() == FRESH_KEYWORD
+    if len(args) != 2 and not fresh:
         await update.message.reply_text(
-            "❌ *Invalid Format*\n\nUse: `/check username password`", 
+            "❌ *Invalid Format*\n\nUse: `/check username password [fresh]`", 
             parse_mode="MarkdownV2"
         )
         return
@@ -131,9 +413,9 @@ async def check_attendance(update: Update, context: CallbackContext):
     )
     
     try:
-        future = asyncio.get_running_loop().create_future()
-        await request_queue.put((context.args[0], context.args[1], future))
-        report_json = await future
+        report_json = await fetch_report_with_position(
+            status_msg, args[0], args[1], fresh, PRIORITY_CHECK, f"tg:{update.effective_user.id}"
+        )
         report = json.loads(report_json)
         
         if "error" in report:
@@ -145,12 +427,16 @@ async def check_attendance(update: Update, context: CallbackContext):
             return
             
         # Format and escape the report
-        formatted_report = format_report(report)
+        with metrics.span("format_report"):
+            formatted_report = format_report(report)
         
-        await status_msg.edit_text(
-            formatted_report,
-            parse_mode="MarkdownV2"
-        )
+        with metrics.span("telegram_edit"):
+            await status_msg.edit_text(
+                formatted_report,
+                parse_mode="MarkdownV2"
+            )
+    except Overloaded as e:
+        await status_msg.edit_text(overloaded_text(e), parse_mode="MarkdownV2")
     except Exception as e:
         logger.error(f"Error in check_attendance: {e}")
         await status_msg.edit_text(
@@ -166,14 +452,16 @@ def format_report(report: dict) -> str:
     ]
     
     overall_percentage = report['overall_percentage']
-    status_icon = "✅" if overall_percentage >= 75 else "❌"
+    status_icon = "✅" if overall_percentage >= ATTENDANCE_THRESHOLD else "❌"
     total_text = f"{report['total_present']}/{report['total_classes']} ({overall_percentage:.2f}%) {status_icon}"
     formatted.append(f"📊 Total: {total_text.translate(MARKDOWN_ESCAPE_TABLE)}")
     
-    if 'skippable_hours' in report:
-        formatted.append(f"⏱ You can skip {str(report['skippable_hours']).translate(MARKDOWN_ESCAPE_TABLE)} hours and still maintain above 75%")
-    elif 'required_hours' in report:
-        formatted.append(f"⏱ You need to attend {str(report['required_hours']).translate(MARKDOWN_ESCAPE_TABLE)} hours to maintain above 75%")
+    threshold_text = f"{ATTENDANCE_THRESHOLD:g}%".translate(MARKDOWN_ESCAPE_TABLE)
+    required_hours = report.get('attendance_status', {}).get('required_hours', report.get('required_hours'))
+    if required_hours:
+        formatted.append(f"⏱ You need to attend {str(required_hours).translate(MARKDOWN_ESCAPE_TABLE)} hours to maintain above {threshold_text}")
+    elif 'skippable_hours' in report:
+        formatted.append(f"⏱ You can skip {str(report['skippable_hours']).translate(MARKDOWN_ESCAPE_TABLE)} hours and still maintain above {threshold_text}")
     
     if report.get('todays_attendance'):
         formatted.append("🕒 *Today's Attendance:*")
@@ -185,16 +473,30 @@ def format_report(report: dict) -> str:
         formatted.append("📚 *Subject\\-wise Attendance:*")
         formatted.extend(f"• {line.translate(MARKDOWN_ESCAPE_TABLE)}" for line in report['subject_attendance'])
     
+    if report.get('cached_at'):
+        updated = time.strftime("%d/%m %H:%M", time.localtime(report['cached_at']))
+        formatted.append(
+            f"🕘 _Last updated {updated.translate(MARKDOWN_ESCAPE_TABLE)}_ \\(add `{FRESH_KEYWORD}` for a live check\\)"
+        )
+    
     return "\n\n".join(formatted)
 
 async def handle_message(update: Update, context: CallbackContext):
-    user = get_user(str(update.effective_user.id))
-    if user and update.message.text.lower() == user[3]:
+    text = update.message.text.lower().split()
+    # Ordinary chat: nobody uses this word as a keyword, so don't look anything up
+    if not text or text[1:] not in ([], [FRESH_KEYWORD]):
+        return
+    if not await is_keyword_async(text[0]):
+        metrics.inc("keyword_index_rejects")
+        return
+    user = await find_user(str(update.effective_user.id))
+    if user and text[0] == user[3]:
         status_msg = await update.message.reply_text("🔄 *Fetching\\.\\.\\.*", parse_mode="MarkdownV2")
+        await record_activity_async(user[0])
         try:
-            future = asyncio.get_running_loop().create_future()
-            await request_queue.put((user[1], user[2], future))
-            report_json = await future
+            report_json = await fetch_report_with_position(
+                status_msg, user[1], user[2], len(text) == 2, PRIORITY_KEYWORD, f"tg:{user[0]}"
+            )
             report = json.loads(report_json)
             
             if "error" in report:
@@ -205,12 +507,17 @@ async def handle_message(update: Update, context: CallbackContext):
                 )
                 return
 
-            formatted_report = format_report(report)
+            # Format and escape the report
+            with metrics.span("format_report"):
+                formatted_report = format_report(report)
             
-            await status_msg.edit_text(
-                formatted_report,
-                parse_mode="MarkdownV2"
-            )
+            with metrics.span("telegram_edit"):
+                await status_msg.edit_text(
+                    formatted_report,
+                    parse_mode="MarkdownV2"
+                )
+        except Overloaded as e:
+            await status_msg.edit_text(overloaded_text(e), parse_mode="MarkdownV2")
         except Exception as e:
             logger.error(f"Error in handle_message: {e}")
             await status_msg.edit_text(
@@ -218,90 +525,508 @@ async def handle_message(update: Update, context: CallbackContext):
                 parse_mode="MarkdownV2"
             )
 
+def format_plan(plan: dict, upcoming: int) -> str:
+    """Format one planner scenario (the next ``upcoming`` classes) with MarkdownV2 escaping"""
+    threshold_text = f"{plan['threshold']:g}%"
+    header = f"next {upcoming} classes per subject, {threshold_text} target"
+    formatted = [f"🗓 *Attendance Plan*\n_{header.translate(MARKDOWN_ESCAPE_TABLE)}_"]
+
+    def describe(row):
+        must_attend = row['must_attend'][upcoming]
+        if must_attend is None:
+            return f"can't reach {threshold_text} within {upcoming} classes"
+        if must_attend == 0:
+            return f"can skip all {upcoming}"
+        return f"attend {must_attend}/{upcoming}, can skip {row['can_skip'][upcoming]}"
+
+    formatted.extend(
+        f"• {row['name']}: {describe(row)}".translate(MARKDOWN_ESCAPE_TABLE) for row in plan['subjects']
+    )
+    formatted.append(f"📊 *Overall:* {describe(plan['overall']).translate(MARKDOWN_ESCAPE_TABLE)}")
+    return "\n\n".join(formatted)
+
+async def plan_command(update: Update, context: CallbackContext):
+    """/plan [classes] for saved accounts, /plan username password [classes] otherwise"""
+    args = list(context.args)
+    upcoming = PLAN_DEFAULT_CLASSES
+    if args and args[-1].isdigit():
+        upcoming = max(1, min(int(args.pop()), PLAN_MAX_CLASSES))
+
+    if len(args) == 2:
+        username, password = args
+        priority = PRIORITY_CHECK
+    elif not args and (user := await find_user(str(update.effective_user.id))):
+        username, password = user[1], user[2]
+        priority = PRIORITY_KEYWORD
+        await record_activity_async(user[0])
+    else:
+        await update.message.reply_text(
+            "❌ *Invalid Format*\n\nUse: `/plan [classes]` after `/set`, or `/plan username password [classes]`",
+            parse_mode="MarkdownV2"
+        )
+        return
+
+    status_msg = await update.message.reply_text("🔄 *Planning\\.\\.\\.*", parse_mode="MarkdownV2")
+    try:
+        report = json.loads(await fetch_report_with_position(
+            status_msg, username, password, False, priority, f"tg:{update.effective_user.id}"
+        ))
+        if "error" in report:
+            error_msg = report["error"].translate(MARKDOWN_ESCAPE_TABLE)
+            await status_msg.edit_text(f"❌ *Error*\n\n_{error_msg}_", parse_mode="MarkdownV2")
+            return
+
+        plan = plan_attendance(report.get("subjects", []), upcoming)
+        with metrics.span("telegram_edit"):
+            await status_msg.edit_text(format_plan(plan, upcoming), parse_mode="MarkdownV2")
+    except Overloaded as e:
+        await status_msg.edit_text(overloaded_text(e), parse_mode="MarkdownV2")
+    except Exception as e:
+        logger.error(f"Error in plan_command: {e}")
+        await status_msg.edit_text(
+            "❌ *Error*\n\n_An unexpected error occurred\\. Please try again\\._",
+            parse_mode="MarkdownV2"
+        )
+
+def format_trend(points: list, trends: list, weeks: int) -> str:
+    """Format overall and per-subject history for the last ``weeks`` weeks with MarkdownV2 escaping"""
+    threshold_text = f"{ATTENDANCE_THRESHOLD:g}%"
+    formatted = [f"📈 *Attendance Trend*\n_{f'last {weeks} weeks'.translate(MARKDOWN_ESCAPE_TABLE)}_"]
+
+    if points:
+        first, last = points[0], points[-1]
+        change = last['percentage'] - first['percentage']
+        overall = (
+            f"{first['percentage']:.2f}% on {first['day']} → {last['percentage']:.2f}% on {last['day']} "
+            f"({change:+.2f})"
+        )
+        formatted.append(f"📊 *Overall:* {overall.translate(MARKDOWN_ESCAPE_TABLE)}")
+
+    below = [t for t in trends if t['below']]
+    if below:
+        lines = []
+        for t in below:
+            window = t['window_percentage']
+            window_text = f"{window:.2f}% in window" if window is not None else "no classes in window"
+            lines.append(f"• {t['name']}: {t['percentage']:.2f}% now, {window_text}".translate(MARKDOWN_ESCAPE_TABLE))
+        formatted.append(f"⚠️ *Trending below {threshold_text.translate(MARKDOWN_ESCAPE_TABLE)}*\n" + "\n".join(lines))
+    else:
+        formatted.append(f"✅ _No subject trending below {threshold_text.translate(MARKDOWN_ESCAPE_TABLE)}_")
+    return "\n\n".join(formatted)
+
+async def trend_command(update: Update, context: CallbackContext):
+    """/trend [weeks] for saved accounts, answered from stored snapshots without scraping"""
+    args = list(context.args)
+    weeks = TREND_DEFAULT_WEEKS
+    if args and args[-1].isdigit():
+        weeks = max(1, min(int(args.pop()), TREND_MAX_WEEKS))
+
+    user = await find_user(str(update.effective_user.id)) if not args else None
+    if user is None:
+        await update.message.reply_text(
+            "❌ *Invalid Format*\n\nUse: `/trend [weeks]` after `/set`",
+            parse_mode="MarkdownV2"
+        )
+        return
+
+    try:
+        username = user[1]
+        # Only history scraped with the saved credentials, not whatever a wrong password produced
+        digest = credential_digest(username, user[2])
+        points, trends = await asyncio.gather(
+            history_store.overall_trend_async(username, digest, weeks),
+            history_store.subject_trends_async(username, digest, weeks),
+        )
+        if not trends:
+            await update.message.reply_text(
+                "ℹ️ *No history yet*\n\n_Check your attendance first; every check is recorded\\._",
+                parse_mode="MarkdownV2"
+            )
+            return
+        await update.message.reply_text(format_trend(points, trends, weeks), parse_mode="MarkdownV2")
+    except Exception as e:
+        logger.error(f"Error in trend_command: {e}")
+        await update.message.reply_text(
+            "❌ *Error*\n\n_An unexpected error occurred\\. Please try again\\._",
+            parse_mode="MarkdownV2"
+        )
+
+def format_changes(report: dict, changes: dict) -> str:
+    """Format a change notification (new marks, threshold crossings) with MarkdownV2 escaping"""
+    threshold_text = f"{ATTENDANCE_THRESHOLD:g}%"
+    formatted = ["🔔 *Attendance Updated*"]
+
+    if changes['marks']:
+        lines = []
+        for name, attended, missed in changes['marks']:
+            parts = [f"+{attended} present" if attended else "", f"+{missed} absent" if missed else ""]
+            lines.append(f"• {name}: {', '.join(p for p in parts if p)}".translate(MARKDOWN_ESCAPE_TABLE))
+        formatted.append("📝 *New marks*\n" + "\n".join(lines))
+
+    crossings = [
+        f"• {name}: {old:.2f}% → {new:.2f}% ({'below' if new < ATTENDANCE_THRESHOLD else 'back above'} {threshold_text})"
+        for name, old, new in changes['crossed']
+    ]
+    if changes['overall']:
+        old, new = changes['overall']
+        crossings.append(
+            f"• Overall: {old:.2f}% → {new:.2f}% ({'below' if new < ATTENDANCE_THRESHOLD else 'back above'} {threshold_text})"
+        )
+    if crossings:
+        formatted.append("⚠️ *Threshold*\n" + "\n".join(c.translate(MARKDOWN_ESCAPE_TABLE) for c in crossings))
+
+    overall_text = f"{report['total_present']}/{report['total_classes']} ({report['overall_percentage']:.2f}%)"
+    formatted.append(f"📊 *Overall:* {overall_text.translate(MARKDOWN_ESCAPE_TABLE)}")
+    return "\n\n".join(formatted)
+
+async def send_changes(phone: str, report: dict, changes: dict):
+    """Notifier callback: message a subscriber about their changed register"""
+    with metrics.span("telegram_send"):
+        await bot_app.bot.send_message(chat_id=int(phone), text=format_changes(report, changes), parse_mode="MarkdownV2")
+
+async def notify_command(update: Update, context: CallbackContext):
+    """/notify on|off for saved accounts"""
+    phone = str(update.effective_user.id)
+    choice = context.args[0].lower() if len(context.args) == 1 else None
+    user = await find_user(phone)
+    if choice not in ("on", "off") or user is None:
+        await update.message.reply_text(
+            "❌ *Invalid Format*\n\nUse: `/notify on` or `/notify off` after `/set`",
+            parse_mode="MarkdownV2"
+        )
+        return
+
+    try:
+        await set_notify_async(phone, choice == "on")
+        if choice == "off":
+            await update.message.reply_text("🔕 *Notifications off*", parse_mode="MarkdownV2")
+            return
+
+        # Record the current register so the first notification is a real change
+        report = json.loads(await fetch_report(user[1], user[2], priority=PRIORITY_KEYWORD, client=f"tg:{phone}"))
+        if "error" in report:
+            error_msg = report["error"].translate(MARKDOWN_ESCAPE_TABLE)
+            await update.message.reply_text(f"❌ *Error*\n\n_{error_msg}_", parse_mode="MarkdownV2")
+            return
+        subjects = report.get("subjects", [])
+        await save_notify_state_async(phone, content_hash(subjects), json.dumps(subjects))
+        await update.message.reply_text(
+            "🔔 *Notifications on*\n\n_You'll get a message when new marks are posted\\._",
+            parse_mode="MarkdownV2"
+        )
+    except Overloaded as e:
+        await update.message.reply_text(overloaded_text(e), parse_mode="MarkdownV2")
+    except Exception as e:
+        logger.error(f"Error in notify_command: {e}")
+        await update.message.reply_text(
+            "❌ *Error*\n\n_An unexpected error occurred\\. Please try again\\._",
+            parse_mode="MarkdownV2"
+        )
+
+# -------------------------------
+# Scraper engine warm-up
+# -------------------------------
+# Set once warm_engine has finished, whether or not it succeeded
+engine_warm = asyncio.Event()
+engine_status = {"state": "starting", "error": None, "seconds": None}
+
+async def warm_engine():
+    """Start the scraper engine; lifespan runs this in the background so the app serves at once
+
+    Imports Playwright/aiohttp and launches Chromium, the slow part of startup.
+    Jobs wait for it in process_queue; /readyz reports it.
+    """
+    started = time.perf_counter()
+    try:
+        if SCRAPER_ENGINE == "http":
+            # Chromium is only launched on demand when the HTTP engine has to fall back
+            logger.info("Starting HTTP scraper engine...")
+            await http_engine.start()
+        else:
+            logger.info("Starting browser pool...")
+            await browser_pool.start()
+    except Exception as e:
+        # Scrapes still work through open_page's one-off browser; /readyz says why it isn't warm
+        logger.error(f"Scraper engine failed to start: {e}")
+        engine_status.update(state="failed", error=str(e))
+    else:
+        engine_status.update(state="warm", error=None)
+        logger.info(f"Scraper engine warm after {time.perf_counter() - started:.2f}s")
+    finally:
+        engine_status["seconds"] = round(time.perf_counter() - started, 3)
+        engine_warm.set()
+
+def bot_username():
+    """The bot's username from the get_me() cached by bot_app.initialize(); None before that"""
+    try:
+        return bot_app.bot.username
+    except RuntimeError:
+        return None
+
 # -------------------------------
 # Background task to process queued requests
 # -------------------------------
-async def process_queue():
+async def scrape_durable(username: str, password: str, priority: int, deadline: float) -> str:
+    """Scrape through worker.py, feeding the outcome to this process's portal circuit breaker
+
+    The workers' breakers live in other processes, so the app judges the portal
+    from each job's result (``portal_unavailable``) the way scrapper does in-process.
+    """
+    try:
+        probe = portal_health.before_scrape()
+    except PortalUnavailable as e:
+        return portal_error(e)
+    settled = False
+    try:
+        report = await durable_queue.scrape(username, password, priority, deadline=deadline)
+        if is_portal_error(json.loads(report)):
+            portal_health.record_failure()
+        else:
+            portal_health.record_success()
+        settled = True
+        return report
+    finally:
+        if probe and not settled:
+            portal_health.release_probe()
+
+async def process_queue(worker_id: int):
+    """Queue worker; QUEUE_WORKERS of these run side by side"""
+    await engine_warm.wait()
     while True:
-        username, password, future = await request_queue.get()
+        job = await request_queue.get()
+        future = job.future
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - job.enqueued_at, priority=PRIORITY_NAMES[job.priority])
+        JOBS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        outcome = "error"
+        remaining = job.deadline - time.monotonic()
         try:
-            # Await the async get_attendance_report directly
-            report = await get_attendance_report(username, password)
+            if future.done():
+                # The caller already gave up on this job
+                outcome = "skipped"
+                continue
+            if remaining <= 0:
+                # Everyone waiting has timed out; don't spend a scrape on it
+                outcome = "expired"
+                future.set_result(json.dumps({"error": EXPIRED_ERROR}))
+                continue
+            if QUEUE_BACKEND == "sqlite":
+                # Scraped by a worker.py process; this worker just holds the slot while it waits
+                coro = scrape_durable(job.username, job.password, job.priority, deadline=time.time() + remaining)
+            else:
+                coro = get_attendance_report(job.username, job.password)
+            scrape = asyncio.ensure_future(asyncio.wait_for(coro, timeout=min(JOB_TIMEOUT, remaining)))
+            # Cancelling the job's future aborts the scrape at its current await;
+            # open_page's context managers then close the page and browser context
+            future.add_done_callback(lambda f: f.cancelled() and scrape.cancel())
+            try:
+                report = await scrape
+            except asyncio.CancelledError:
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    outcome = "cancelled"
+                    logger.info(f"Worker {worker_id}: aborted abandoned job for {job.username}")
+                    continue
+                raise
             # If report is not a string, convert it to a JSON string
             if not isinstance(report, str):
                 report = json.dumps(report)
-            future.set_result(report)
+            outcome = "error" if "error" in json.loads(report) else "ok"
+            if not future.done():
+                future.set_result(report)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.error(f"Worker {worker_id}: job for {job.username} timed out after {min(JOB_TIMEOUT, remaining):.0f}s")
+            if not future.done():
+                future.set_result(json.dumps({"error": "The portal took too long to respond. Please try again."}))
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
         except Exception as e:
-            logger.error(f"Error processing queue: {e}")
-            future.set_exception(e)
+            logger.error(f"Worker {worker_id}: error processing queue: {e}")
+            if not future.done():
+                future.set_exception(e)
         finally:
-            request_queue.task_done()
+            JOBS_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - started
+            JOB_SECONDS.observe(elapsed, outcome=outcome)
+            if outcome not in ("skipped", "expired", "cancelled"):
+                request_queue.record_job_time(elapsed)
 
 # -------------------------------
 # Create FastAPI app with endpoints
 # -------------------------------
+def register_handlers(application: Application):
+    """Attach the bot's command and keyword handlers (bench/replay.py reuses this)"""
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("set", set_credentials))
+    application.add_handler(CommandHandler("check", check_attendance))
+    application.add_handler(CommandHandler("plan", plan_command))
+    application.add_handler(CommandHandler("trend", trend_command))
+    application.add_handler(CommandHandler("notify", notify_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI"""
     # Startup
+    if TELEGRAM_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_MODE=webhook requires WEBHOOK_SECRET")
+
+    init_storage()
+    logger.info("Loading keyword index...")
+    await load_keyword_index_async()
+    logger.info(f"Keyword index holds {len(keyword_index)} users")
+
+    warmup = None
+    if QUEUE_BACKEND == "sqlite":
+        # Scraping happens in worker.py processes; this process only enqueues and waits
+        logger.info("Using the durable job queue...")
+        await durable_queue.start()
+        engine_status.update(state="warm", seconds=0)
+        engine_warm.set()
+    else:
+        warmup = asyncio.create_task(warm_engine())
+
     logger.info("Registering Telegram handlers...")
-    bot_app.add_handler(CommandHandler("start", start))
-    bot_app.add_handler(CommandHandler("set", set_credentials))
-    bot_app.add_handler(CommandHandler("check", check_attendance))
-    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    register_handlers(bot_app)
     
     logger.info("Initializing Telegram bot...")
     await bot_app.initialize()
     logger.info("Starting Telegram bot...")
     await bot_app.start()
-    logger.info("Running bot polling in background...")
-    
-    # Start bot polling in a separate thread
+    polling_thread = None
     stop_polling = threading.Event()
+    if TELEGRAM_MODE == "webhook":
+        # Updates arrive on WEBHOOK_PATH and are handled on this loop; no polling thread
+        if WEBHOOK_URL:
+            webhook_url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+            logger.info(f"Registering webhook {webhook_url}...")
+            await bot_app.bot.set_webhook(
+                webhook_url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            logger.info(f"Webhook mode: expecting updates on {WEBHOOK_PATH} (webhook registered elsewhere)")
+    else:
+        logger.info("Running bot polling in background...")
+
+        # Start bot polling in a separate thread
+        def run_polling():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(bot_app.updater.start_polling(allowed_updates=Update.ALL_TYPES))
+                while not stop_polling.is_set():
+                    loop.run_until_complete(asyncio.sleep(1))
+            except Exception as e:
+                logger.error(f"Polling error: {e}")
+            finally:
+                loop.run_until_complete(bot_app.updater.stop())
+                loop.close()
+
+        polling_thread = threading.Thread(target=run_polling, daemon=True)
+        polling_thread.start()
     
-    def run_polling():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(bot_app.updater.start_polling(allowed_updates=Update.ALL_TYPES))
-            while not stop_polling.is_set():
-                loop.run_until_complete(asyncio.sleep(1))
-        except Exception as e:
-            logger.error(f"Polling error: {e}")
-        finally:
-            loop.run_until_complete(bot_app.updater.stop())
-            loop.close()
-    
-    polling_thread = threading.Thread(target=run_polling, daemon=True)
-    polling_thread.start()
+    # Start queue workers
+    logger.info(f"Starting {QUEUE_WORKERS} queue workers...")
+    queue_tasks = [asyncio.create_task(process_queue(i)) for i in range(QUEUE_WORKERS)]
     
-    # Start queue processor
-    queue_task = asyncio.create_task(process_queue())
+    # Warm the report cache for saved users during the prefetch windows
+    queue_tasks.append(asyncio.create_task(Prefetcher(refresh_report).run()))
+
+    # Message opted-in users when their register changes
+    queue_tasks.append(asyncio.create_task(Notifier(refresh_report, send_changes).run()))
     
+    if warmup is not None:
+        queue_tasks.append(warmup)
+
     try:
         yield
     finally:
         # Shutdown
         logger.info("Shutting down...")
-        stop_polling.set()
-        polling_thread.join(timeout=5)
-        queue_task.cancel()
+        if polling_thread is not None:
+            stop_polling.set()
+            polling_thread.join(timeout=5)
+        for task in queue_tasks:
+            task.cancel()
+        await asyncio.gather(*queue_tasks, return_exceptions=True)
         try:
             await asyncio.gather(
                 bot_app.stop(),
                 bot_app.shutdown(),
                 return_exceptions=True
             )
+            await browser_pool.stop()
+            await http_engine.stop()
+            await durable_queue.stop()
+            await resource_governor.stop()
+            close_db()
         except Exception as e:
             logger.error(f"Shutdown error: {e}")
 
+def client_key(request: Request) -> str:
+    """Rate-limit key for an API caller"""
+    return f"ip:{request.client.host}" if request.client else None
+
+def too_many_requests(error: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        {"error": str(error), "retry_after": error.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def unless_disconnected(request: Request, coro):
+    """Await ``coro`` unless the client hangs up first; then cancel it and return None
+
+    Cancelling fetch_report cancels the scrape too if nobody else is waiting for it.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.inc("client_disconnects")
+                return None
+    finally:
+        task.cancel()
+
 def create_fastapi_app() -> FastAPI:
     app_api = FastAPI(lifespan=lifespan)
     
     @app_api.get("/")
     async def index():
-        bot_info = await bot_app.bot.get_me()
-        return JSONResponse({"status": "online", "bot": bot_info.username})
+        return JSONResponse({
+            "status": "online",
+            "bot": bot_username(),
+            "browsers": browser_pool.health(),
+            "portal_sessions": session_store.stats(),
+            "durable_jobs_waiting": durable_queue.pending(),
+            "portal": portal_health.status(),
+            "memory": resource_governor.status(),
+            "stats": metrics.snapshot(),
+        })
+    
+    @app_api.get("/healthz")
+    async def healthz():
+        """Liveness: the event loop answers; touches nothing else"""
+        return JSONResponse({"status": "ok"})
+
+    @app_api.get("/readyz")
+    async def readyz():
+        """Readiness: the bot is initialised and the scraper engine has warmed up"""
+        ready = bot_username() is not None and engine_status["state"] == "warm"
+        return JSONResponse(
+            {"status": "ready" if ready else "not_ready", "bot": bot_username(), "engine": engine_status},
+            status_code=200 if ready else 503,
+        )
+
+    @app_api.get("/metrics")
+    async def metrics_route():
+        """Prometheus scrape endpoint"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
     
     @app_api.post("/attendance")
     async def attendance_route(request: Request):
@@ -309,16 +1034,96 @@ def create_fastapi_app() -> FastAPI:
         username, password = data.get("username"), data.get("password")
         if not username or not password:
             return JSONResponse({"error": "Missing username or password"}, status_code=400)
-        future = asyncio.get_running_loop().create_future()
-        await request_queue.put((username, password, future))
-        result = await future
+        try:
+            timeout = min(float(data.get("timeout", JOB_DEADLINE)), JOB_DEADLINE)
+        except (TypeError, ValueError):
+            return JSONResponse({"error": "timeout must be a number of seconds"}, status_code=400)
+        try:
+            result = await unless_disconnected(request, fetch_report(
+                username, password, fresh=bool(data.get("fresh")), priority=PRIORITY_API,
+                client=client_key(request), deadline=time.monotonic() + timeout
+            ))
+        except Overloaded as e:
+            return too_many_requests(e)
+        if result is None:
+            return JSONResponse({"error": "Client disconnected"}, status_code=499)
         return JSONResponse(json.loads(result))
     
+    @app_api.post("/attendance/batch")
+    async def attendance_batch_route(request: Request):
+        """{"accounts": [{"username", "password"}, ...], "fresh"?, "concurrency"?} -> NDJSON stream"""
+        data = await request.json()
+        accounts = data.get("accounts")
+        if not isinstance(accounts, list) or not accounts or not all(isinstance(a, dict) for a in accounts):
+            return JSONResponse({"error": "accounts must be a non-empty list of {username, password}"}, status_code=400)
+        if len(accounts) > BATCH_MAX_ACCOUNTS:
+            return JSONResponse({"error": f"At most {BATCH_MAX_ACCOUNTS} accounts per batch"}, status_code=400)
+        try:
+            concurrency = min(int(data.get("concurrency", BATCH_CONCURRENCY)), BATCH_CONCURRENCY)
+        except (TypeError, ValueError):
+            return JSONResponse({"error": "concurrency must be an integer"}, status_code=400)
+        # One batch is one request: charging every account would reject most of any batch over the burst
+        try:
+            rate_limiter.check(client_key(request))
+        except Overloaded as e:
+            metrics.inc("rejected_rate_limited")
+            return too_many_requests(e)
+        metrics.inc("batch_requests")
+        return StreamingResponse(
+            stream_batch(accounts, fresh=bool(data.get("fresh")), concurrency=concurrency),
+            media_type="application/x-ndjson"
+        )
+    
+    if TELEGRAM_MODE == "webhook":
+        @app_api.post(WEBHOOK_PATH)
+        async def telegram_webhook(request: Request):
+            """Telegram Bot API webhook; hands the update to the bot on this event loop"""
+            secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+                metrics.inc("webhook_rejected")
+                return JSONResponse({"error": "Forbidden"}, status_code=403)
+            try:
+                update = Update.de_json(await request.json(), bot_app.bot)
+            except Exception as e:
+                logger.warning(f"Bad webhook payload: {e}")
+                return JSONResponse({"error": "Invalid update"}, status_code=400)
+            # Answer Telegram right away; the Application's update loop runs the handlers
+            await bot_app.update_queue.put(update)
+            metrics.inc("webhook_updates")
+            return JSONResponse({"ok": True})
+    
+    @app_api.post("/plan")
+    async def plan_route(request: Request):
+        """What-if plan from posted subjects, or from the (cached) report for username/password"""
+        data = await request.json()
+        subjects = data.get("subjects")
+        if subjects is None:
+            username, password = data.get("username"), data.get("password")
+            if not username or not password:
+                return JSONResponse({"error": "Missing subjects or username/password"}, status_code=400)
+            try:
+                report = json.loads(await fetch_report(username, password, priority=PRIORITY_API, client=client_key(request)))
+            except Overloaded as e:
+                return too_many_requests(e)
+            if "error" in report:
+                return JSONResponse(report)
+            subjects = report.get("subjects", [])
+        try:
+            max_classes = min(int(data.get("max_classes", PLAN_MAX_CLASSES)), PLAN_CLASSES_LIMIT)
+            plan = plan_attendance(subjects, max_classes, float(data.get("threshold", ATTENDANCE_THRESHOLD)))
+        except (KeyError, TypeError, ValueError) as e:
+            return JSONResponse({"error": f"Invalid plan request: {e}"}, status_code=400)
+        return JSONResponse(plan)
+    
     return app_api
 
 # -------------------------------
 # Main entry point
 # -------------------------------
+# Module-level so `uvicorn app:app_api --workers N` (Dockerfile, deploy.sh) can import it
+app_api = create_fastapi_app()
+
 if __name__ == "__main__":
-    app_api = create_fastapi_app()
+    import uvicorn
+
     uvicorn.run(app_api, host="0.0.0.0", port=5000, log_level="info")
\ No newline at end of file
@@ -0,0 +1 @@
+"""Offline tooling: a stand-in ECAP portal and load/benchmark drivers."""
@@ -0,0 +1,111 @@
+"""Lookup/write throughput of the user store under concurrent handlers.
+
+    python -m bench.bench_db --handlers 50 --ops 200 --users 1000
+
+Compares three ways a handler can hit SQLite:
+    connect   a new sqlite3.connect() per call on the event loop (the original model.py)
+    sync      model.get_user/save_user on the loop with the persistent WAL connection
+    async     model.get_user_async/save_user_async on the DB thread pool
+and reports operations per second plus the worst event-loop stall seen while
+the handlers ran (what every other chat waits for).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+
+async def measure_loop_lag(stop, interval=0.005):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run_mode(mode, model, args):
+    def connect_get(phone):
+        db = sqlite3.connect(model.DATABASE_PATH)
+        try:
+            return db.execute(model.GET_USER_SQL, (phone,)).fetchone()
+        finally:
+            db.close()
+
+    def connect_save(phone, username, password, keyword):
+        db = sqlite3.connect(model.DATABASE_PATH)
+        try:
+            db.execute(model.SAVE_USER_SQL, (phone, username, password, keyword))
+            db.commit()
+        finally:
+            db.close()
+
+    async def lookup(phone):
+        if mode == "connect":
+            return connect_get(phone)
+        if mode == "sync":
+            return model.get_user(phone)
+        return await model.get_user_async(phone)
+
+    async def write(phone):
+        values = (phone, f"USER{phone}", "secret", f"kw{phone}")
+        if mode == "connect":
+            return connect_save(*values)
+        if mode == "sync":
+            return model.save_user(*values)
+        return await model.save_user_async(*values)
+
+    async def handler(seed):
+        rng = random.Random(seed)
+        for _ in range(args.ops):
+            phone = str(rng.randrange(args.users))
+            if rng.random() < args.write_ratio:
+                await write(phone)
+            else:
+                await lookup(phone)
+            # Let other handlers interleave, as real updates would
+            await asyncio.sleep(0)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(args.handlers)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_lag = await lag_task
+    total_ops = args.handlers * args.ops
+    print(f"{mode:<8} {total_ops:>8} {elapsed:>8.2f} {total_ops / elapsed:>10.0f} {worst_lag * 1000:>12.1f}")
+
+
+async def main_async(args):
+    import model
+
+    model.init_db()
+    for i in range(args.users):
+        model.save_user(str(i), f"USER{i}", "secret", f"kw{i}")
+
+    print(f"{'mode':<8} {'ops':>8} {'seconds':>8} {'ops/s':>10} {'max lag ms':>12}")
+    for mode in args.modes:
+        await run_mode(mode, model, args)
+    model.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=50, help="concurrent handler tasks")
+    parser.add_argument("--ops", type=int, default=200, help="operations per handler")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    parser.add_argument("--modes", nargs="+", choices=("connect", "sync", "async"), default=["connect", "sync", "async"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
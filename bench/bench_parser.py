@@ -0,0 +1,53 @@
+"""Compare the lxml register parser against the original BeautifulSoup one.
+
+    python -m bench.bench_parser                      # generated pages of several sizes
+    python -m bench.bench_parser saved_register.html  # recorded pages
+
+Each page is parsed with both implementations, the outputs are checked for
+equality, and the mean time per parse is reported.
+"""
+import argparse
+import pathlib
+import timeit
+
+from bench.fake_portal import render_register
+from scrapper import parse_attendance_data, parse_attendance_data_bs4
+
+# (subjects, class dates) - roughly start, middle and end of a semester
+GENERATED_SIZES = [(8, 10), (8, 60), (10, 120), (12, 200)]
+
+
+def load_pages(paths):
+    if paths:
+        return [(path, pathlib.Path(path).read_text(encoding="utf-8", errors="replace")) for path in paths]
+    return [
+        (f"{subjects} subjects x {dates} dates", render_register("21L31A0501", subjects, dates))
+        for subjects, dates in GENERATED_SIZES
+    ]
+
+
+def time_parser(func, html, repeat):
+    number = max(1, repeat)
+    return min(timeit.repeat(lambda: func(html), number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="recorded register pages (HTML files)")
+    parser.add_argument("--repeat", type=int, default=50, help="parses per timing run")
+    args = parser.parse_args()
+
+    print(f"{'page':<32} {'KiB':>7} {'bs4 ms':>9} {'lxml ms':>9} {'speedup':>8}")
+    for name, html in load_pages(args.pages):
+        if parse_attendance_data(html) != parse_attendance_data_bs4(html):
+            raise SystemExit(f"{name}: parsers disagree")
+        bs4_time = time_parser(parse_attendance_data_bs4, html, args.repeat)
+        lxml_time = time_parser(parse_attendance_data, html, args.repeat)
+        print(
+            f"{name:<32} {len(html) / 1024:>7.1f} {bs4_time * 1000:>9.2f} "
+            f"{lxml_time * 1000:>9.2f} {bs4_time / lxml_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
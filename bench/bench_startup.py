@@ -0,0 +1,84 @@
+"""Measure how long a fresh interpreter takes to import the app.
+
+    python -m bench.bench_startup               # import app, 10 runs
+    python -m bench.bench_startup --runs 20 --top 15
+    python -m bench.bench_startup --module worker
+
+Each run is a new ``python -X importtime`` process with DATABASE_PATH in a temp
+dir. It reports the median import time of the module twice: as it is, and
+with the lazily imported engine dependencies (Playwright, aiohttp, bs4, NumPy,
+uvicorn) loaded up front the way startup used to work. It also lists the
+slowest imports by cumulative time and checks that none of the deferred
+modules was imported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Loaded on first use (warm-up, first /plan, bench_parser, __main__), not on import
+DEFERRED = ("playwright.async_api", "aiohttp", "bs4", "numpy", "uvicorn")
+
+
+def import_once(module, preload, env):
+    """Return (wall seconds, {module: cumulative µs}, loaded modules) for one fresh import"""
+    code = (
+        "import sys, time\n"
+        "started = time.perf_counter()\n"
+        f"for name in {list(preload)!r}: __import__(name)\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - started)\n"
+        "print(' '.join(sys.modules))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if cum.strip().isdigit():
+            cumulative[name.strip()] = int(cum)
+    seconds, loaded = proc.stdout.splitlines()[-2:]
+    return float(seconds), cumulative, set(loaded.split())
+
+
+def measure(module, preload, runs, env):
+    times, last = [], None
+    for _ in range(runs):
+        seconds, cumulative, loaded = import_once(module, preload, env)
+        times.append(seconds)
+        last = cumulative, loaded
+    return statistics.median(times), *last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="module to import (app, worker, scrapper, ...)")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, "bench.db"), JOB_DATABASE_PATH=os.path.join(tmp, "jobs.db"))
+        lazy, cumulative, loaded = measure(args.module, (), args.runs, env)
+        eager, _, _ = measure(args.module, DEFERRED, args.runs, env)
+
+    print(f"import {args.module}: {lazy * 1000:.0f} ms (median of {args.runs})")
+    print(f"with deferred modules imported up front: {eager * 1000:.0f} ms ({eager / lazy:.1f}x)")
+    print("\nslowest imports (cumulative):")
+    for name, micros in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {micros / 1000:>8.1f} ms  {name}")
+
+    eagerly_loaded = [name for name in DEFERRED if name in loaded]
+    if eagerly_loaded:
+        raise SystemExit(f"\nimported on startup although deferred: {', '.join(eagerly_loaded)}")
+    print(f"\nnot imported: {', '.join(DEFERRED)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Local stand-in for the ECAP portal.
+
+Serves a login page with the same element IDs and JS hooks the scraper relies
+on (#txtId2, #txtPwd2, #hdnpwd2, #imgBtn2, #lblError2, encryptJSText, setValue),
+a #divscreens landing page, and a generated academic register page. Every
+response can be delayed (``--latency``/``--jitter``) or failed with HTTP 500
+(``--failure-rate``); ``GET /__stats`` returns request counters.
+
+    python -m bench.fake_portal --port 8765 --latency 0.3 --failure-rate 0.02
+    PORTAL_BASE_URL=http://127.0.0.1:8765 SCRAPER_ENGINE=http uvicorn app:app_api
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import random
+import secrets
+
+from aiohttp import web
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from config import PORTAL_AES_KEY
+
+SESSION_COOKIE = "ASP.NET_SessionId"
+DEFAULT_PASSWORD = "secret"
+
+LOGIN_PAGE = """<html><head><title>Vignan ECAP</title>
+<script>
+function encryptJSText(id) {{ document.getElementById('hdnpwd' + id).value = ''; }}
+function setValue(id) {{ return true; }}
+</script></head>
+<body><form method="post" action="Default.aspx" id="form1">
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="CA0B0334" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{viewstate}" />
+<input name="txtId2" type="text" id="txtId2" />
+<input name="txtPwd2" type="password" id="txtPwd2" />
+<input type="hidden" name="hdnpwd2" id="hdnpwd2" value="" />
+<input type="image" name="imgBtn2" id="imgBtn2" src="images/login.gif" />
+<span id="lblError2">{error}</span>
+</form></body></html>"""
+
+HOME_PAGE = """<html><body><div id="divscreens">Welcome {username}</div></body></html>"""
+
+
+def decrypt_password(value: str, key: str = PORTAL_AES_KEY) -> str:
+    key_bytes = key.encode()
+    decryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(key_bytes)).decryptor()
+    padded = decryptor.update(base64.b64decode(value)) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return (unpadder.update(padded) + unpadder.finalize()).decode()
+
+
+def render_register(student_id: str, num_subjects: int = 8, num_dates: int = 40, today: datetime.date = None) -> str:
+    """Build an academic register page with one column per class date, ending today"""
+    today = today or datetime.date.today()
+    dates = [(today - datetime.timedelta(days=num_dates - 1 - i)).strftime("%d/%m") for i in range(num_dates)]
+    header = "".join(f"<td>{d}</td>" for d in ["Sl.No", "Subject", *dates, "Attended/Held", "%"])
+    rows = []
+    for s in range(num_subjects):
+        cells = []
+        present = held = 0
+        for d in range(num_dates):
+            if (d + s) % 3 == 0:
+                cells.append("&nbsp;")
+                continue
+            mark = "A" if (d * 7 + s) % 5 == 0 else "P"
+            held += 1
+            present += mark == "P"
+            cells.append(mark)
+        percentage = f"{present / held * 100:.2f}" if held else ".00"
+        tds = [str(s + 1), f"SUBJECT-{s + 1}", *cells, f"{present}/{held}", percentage]
+        rows.append(
+            f'<tr title="SUBJECT-{s + 1}">' + "".join(f'<td class="cellBorder">{c}</td>' for c in tds) + "</tr>"
+        )
+    return (
+        "<html><body><table>"
+        f'<tr><td class="reportData2">: {student_id}</td></tr>'
+        f'<tr class="reportHeading2WithBackground">{header}</tr>'
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+class FakePortal:
+    """Accepts any username whose password matches ``password``
+
+    ``latency`` seconds (+/- ``jitter``) are added to every response and a
+    ``failure_rate`` fraction of requests fail with HTTP 500.
+    """
+
+    def __init__(
+        self,
+        password: str = DEFAULT_PASSWORD,
+        num_subjects: int = 8,
+        num_dates: int = 40,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+    ):
+        self.password = password
+        self.num_subjects = num_subjects
+        self.num_dates = num_dates
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.viewstate = base64.b64encode(secrets.token_bytes(48)).decode()
+        self.sessions = {}
+        self.requests = 0
+        self.failures = 0
+        self.logins = 0
+        self.register_hits = 0
+
+    @web.middleware
+    async def inject_faults(self, request, handler):
+        if request.path == "/__stats":
+            return await handler(request)
+        self.requests += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            return web.Response(status=500, text="Injected failure")
+        return await handler(request)
+
+    async def stats(self, request):
+        return web.json_response({
+            "requests": self.requests,
+            "failures": self.failures,
+            "logins": self.logins,
+            "register_hits": self.register_hits,
+            "sessions": len(self.sessions),
+        })
+
+    def _login_page(self, error=""):
+        return web.Response(
+            text=LOGIN_PAGE.format(viewstate=self.viewstate, error=error), content_type="text/html"
+        )
+
+    async def login_get(self, request):
+        return self._login_page()
+
+    async def login_post(self, request):
+        form = await request.post()
+        if form.get("__VIEWSTATE") != self.viewstate:
+            return web.Response(status=500, text="Invalid viewstate")
+        password = form.get("txtPwd2", "")
+        if form.get("hdnpwd2"):
+            try:
+                password = decrypt_password(form["hdnpwd2"])
+            except ValueError:
+                password = None
+        username = form.get("txtId2", "")
+        if not username or password != self.password:
+            return self._login_page(error="Invalid Username or Password")
+
+        self.logins += 1
+        token = secrets.token_hex(12)
+        self.sessions[token] = username
+        response = web.Response(text=HOME_PAGE.format(username=username), content_type="text/html")
+        response.set_cookie(SESSION_COOKIE, token)
+        return response
+
+    async def register(self, request):
+        username = self.sessions.get(request.cookies.get(SESSION_COOKIE))
+        if username is None:
+            raise web.HTTPFound("/Default.aspx")
+        self.register_hits += 1
+        return web.Response(
+            text=render_register(username, self.num_subjects, self.num_dates), content_type="text/html"
+        )
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject_faults])
+        app.router.add_get("/__stats", self.stats)
+        app.router.add_get("/Default.aspx", self.login_get)
+        app.router.add_post("/Default.aspx", self.login_post)
+        app.router.add_get("/Academics/studentacadamicregister.aspx", self.register)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in ECAP portal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--subjects", type=int, default=8)
+    parser.add_argument("--dates", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds on top of --latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    args = parser.parse_args()
+    portal = FakePortal(args.password, args.subjects, args.dates, args.latency, args.jitter, args.failure_rate)
+    web.run_app(portal.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
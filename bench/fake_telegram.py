@@ -0,0 +1,162 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers the methods the bot uses (getMe, sendMessage, editMessageText,
+setWebhook, ...) under ``/bot<token>/<method>`` the way python-telegram-bot
+expects. Every call can be delayed (``--latency``/``--jitter``). Sends and
+edits can be throttled per chat (``--chat-rate``) and overall
+(``--global-rate``); a throttled call gets 429 with ``retry_after`` like
+Telegram's flood control. ``GET /__stats`` returns per-method call counts.
+
+    python -m bench.fake_telegram --port 8081 --latency 0.05 --chat-rate 1
+    # then build the bot with base_url="http://127.0.0.1:8081/bot" (bench/replay.py does)
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from admission import TokenBucket
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Attendance Bench",
+    "username": "attendance_bench_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+# Calls that put a message on a chat; these are what flood control counts
+MESSAGE_METHODS = {"sendmessage", "editmessagetext", "sendphoto", "senddocument"}
+
+
+def decode_params(params) -> dict:
+    """python-telegram-bot posts form fields with JSON-encoded values (chat_id=123, reply_markup={...})"""
+    decoded = {}
+    for key, value in params.items():
+        try:
+            decoded[key] = json.loads(value)
+        except (TypeError, ValueError):
+            decoded[key] = value
+    return decoded
+
+
+class FakeTelegram:
+    """Bot API state: message ids per chat, call counters and flood-control buckets"""
+
+    def __init__(self, latency=0.0, jitter=0.0, chat_rate=0.0, global_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate)) if global_rate > 0 else None
+        self.chat_buckets = {}
+        self.next_message_id = {}
+        self.calls = Counter()
+        self.flood_limited = Counter()
+        self.error_replies = 0
+
+    def throttle(self, chat_id) -> float:
+        """Seconds the caller has to wait (0 when the call may go through)"""
+        if self.chat_rate > 0:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, max(1.0, self.chat_rate))
+            wait = bucket.take()
+            if wait:
+                return wait
+        if self.global_bucket is not None:
+            return self.global_bucket.take()
+        return 0.0
+
+    def message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            message_id = self.next_message_id.get(chat_id, 0) + 1
+            self.next_message_id[chat_id] = message_id
+        if isinstance(text, str) and text.startswith("❌"):
+            self.error_replies += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    def answer(self, method, params):
+        if method == "getme":
+            return BOT_USER
+        if method == "sendmessage":
+            return self.message(params.get("chat_id"), params.get("text"))
+        if method == "editmessagetext":
+            if "inline_message_id" in params:
+                return True
+            return self.message(params.get("chat_id"), params.get("text"), params.get("message_id"))
+        if method == "getupdates":
+            return []
+        if method == "getwebhookinfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = decode_params(await request.post())
+        self.calls[method] += 1
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if method in MESSAGE_METHODS:
+            wait = self.throttle(params.get("chat_id"))
+            if wait:
+                self.flood_limited[method] += 1
+                retry_after = max(1, math.ceil(wait))
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+        return web.json_response({"ok": True, "result": self.answer(method, params)})
+
+    async def stats(self, request):
+        return web.json_response({
+            "calls": dict(self.calls),
+            "total": sum(self.calls.values()),
+            "flood_limited": dict(self.flood_limited),
+            "error_replies": self.error_replies,
+            "chats": len(self.next_message_id),
+        })
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/__stats", self.stats)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds on top of --latency")
+    parser.add_argument("--chat-rate", type=float, default=0.0, help="messages/edits per second per chat before 429 (0 = unlimited)")
+    parser.add_argument("--global-rate", type=float, default=0.0, help="messages/edits per second overall before 429 (0 = unlimited)")
+    args = parser.parse_args()
+
+    telegram = FakeTelegram(args.latency, args.jitter, args.chat_rate, args.global_rate)
+    web.run_app(telegram.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
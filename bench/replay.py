@@ -0,0 +1,346 @@
+"""Replay Telegram Updates through the bot against a stand-in Bot API.
+
+Starts ``bench.fake_telegram`` in its own process and builds the bot's
+Application against it with the app's own handlers. It then feeds Updates into
+``update_queue`` at ``--rate`` per second, the same path polling and webhook
+mode use. Updates are synthetic (a mix of /start, /set, /check, /plan, saved
+keywords and plain chat) or recorded (``--updates``).
+
+The scraper is stubbed by default: each scrape sleeps ``--scrape-latency``
+and returns a pre-parsed report, so only the message path is measured. With
+``--scraper portal`` it scrapes ``bench.fake_portal`` with the HTTP engine.
+
+    python -m bench.replay --count 500 --rate 50 --chats 100
+    python -m bench.replay --count 500 --rate 50 --concurrent-updates 1 --chat-rate 1
+    python -m bench.replay --updates updates.jsonl --rate 20 --scraper portal --latency 0.2
+
+It reports:
+- handler latency, from when process_update starts until it finishes;
+- end-to-end latency, from when the Update was queued until it finished;
+- outbound Bot API calls by method, with any 429s from ``--chat-rate``/``--global-rate``;
+- event-loop lag;
+- handler exceptions.
+
+``--updates`` takes JSON lines, each holding one Update, a list of Updates, or a
+getUpdates response. RATE_LIMIT_PER_MINUTE defaults to 0 (off) here, because
+synthetic chats send far more than a real student would.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+from bench.run import free_port, percentile
+
+TOKEN = "123456:BENCH"
+SYNTHETIC_MIX = "start=1,set=1,check=4,keyword=4,plan=1,chat=1"
+COMMANDS = {"start", "set", "check", "plan"}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in COMMANDS | {"keyword", "chat"}:
+            raise SystemExit(f"Unknown update kind in --mix: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def message_update(update_id, chat_id, text):
+    """A private-chat text Update; commands get the bot_command entity CommandHandler looks for"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Student"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def synthetic_updates(args):
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    updates = []
+    for i in range(args.count):
+        chat = rng.randrange(args.chats)
+        username = f"BENCH{chat:04d}"
+        fresh = " fresh" if rng.random() < args.fresh else ""
+        kind = rng.choices(kinds, weights)[0]
+        text = {
+            "start": "/start",
+            "set": f"/set {username} {args.password} kw{chat}",
+            "check": f"/check {username} {args.password}{fresh}",
+            "plan": "/plan",
+            "keyword": f"kw{chat}{fresh}",
+            "chat": "thanks, see you tomorrow",
+        }[kind]
+        updates.append(message_update(i + 1, chat + 1, text))
+    return updates
+
+
+def recorded_updates(path):
+    updates = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if isinstance(data, dict) and "result" in data:
+                data = data["result"]
+            updates.extend(data if isinstance(data, list) else [data])
+    # Replays may repeat a stream; PTB doesn't care, but keep ids unique for the timing table
+    for i, update in enumerate(updates):
+        update["update_id"] = i + 1
+    return updates
+
+
+def start_server(module, port, extra):
+    """Run a bench stand-in (fake_telegram / fake_portal) and wait until it answers"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", module, "--port", str(port)] + extra,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise SystemExit(f"{module} did not start")
+
+
+def server_stats(port):
+    return json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=5).read())
+
+
+async def sample_loop_lag(lags, interval=0.005):
+    """How late a short sleep wakes up: time the loop spent on something else"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def replay(args, updates, telegram_port):
+    # Imported here so the environment set in main() is what config.py reads
+    from telegram import Update
+    from telegram.ext import Application
+
+    import app
+    import model
+    from http_engine import http_engine
+    from bench.fake_portal import render_register
+    from scrapper import build_report
+
+    # app.py configures INFO logging; per-update lines would drown the results
+    logging.getLogger().setLevel(args.log_level)
+
+    queued, handler_times, end_to_end = {}, [], []
+    errors = Counter()
+    finished = asyncio.Event()
+
+    class TimedApplication(Application):
+        async def process_update(self, update):
+            started = time.perf_counter()
+            try:
+                await super().process_update(update)
+            finally:
+                now = time.perf_counter()
+                handler_times.append(now - started)
+                end_to_end.append(now - queued.pop(update.update_id, started))
+                if len(end_to_end) == len(updates):
+                    finished.set()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    bot_app = (
+        Application.builder()
+        .application_class(TimedApplication)
+        .token(TOKEN)
+        .base_url(f"http://127.0.0.1:{telegram_port}/bot")
+        .concurrent_updates(args.concurrent_updates)
+        .build()
+    )
+    app.bot_app = bot_app
+    app.register_handlers(bot_app)
+    bot_app.add_error_handler(count_error)
+
+    app.init_storage()
+    chats = {update["message"]["chat"]["id"] for update in updates if "message" in update}
+    for chat in chats:
+        model.save_user(str(chat), f"BENCH{chat - 1:04d}", args.password, f"kw{chat - 1}")
+    await model.load_keyword_index_async()
+
+    if args.scraper == "stub":
+        reports = {}
+
+        async def stub_scrape(username, password):
+            await asyncio.sleep(max(0.0, args.scrape_latency + random.uniform(-args.scrape_jitter, args.scrape_jitter)))
+            if random.random() < args.scrape_failure_rate:
+                return json.dumps({"error": "Stubbed portal failure"})
+            if username not in reports:
+                html = render_register(username, 8, args.dates)
+                reports[username] = await asyncio.to_thread(build_report, html, username, password)
+            return reports[username]
+
+        app.get_attendance_report = stub_scrape
+        app.engine_status.update(state="warm", seconds=0)
+        app.engine_warm.set()
+    else:
+        await app.warm_engine()
+
+    await bot_app.initialize()
+    await bot_app.start()
+    workers = [asyncio.create_task(app.process_queue(i)) for i in range(args.workers)]
+    lags = []
+    lag_task = asyncio.create_task(sample_loop_lag(lags))
+    stats_before = server_stats(telegram_port)
+
+    started = time.perf_counter()
+    for i, data in enumerate(updates):
+        if args.rate > 0:
+            await asyncio.sleep(max(0.0, started + i / args.rate - time.perf_counter()))
+        update = Update.de_json(data, bot_app.bot)
+        queued[update.update_id] = time.perf_counter()
+        await bot_app.update_queue.put(update)
+    sent = time.perf_counter() - started
+    drained = True
+    try:
+        await asyncio.wait_for(finished.wait(), timeout=args.drain_timeout)
+    except asyncio.TimeoutError:
+        drained = False
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(lag_task, *workers, return_exceptions=True)
+    await bot_app.stop()
+    await bot_app.shutdown()
+    await http_engine.stop()
+    model.close_db()
+
+    stats_after = server_stats(telegram_port)
+    calls = {
+        method: count - stats_before["calls"].get(method, 0)
+        for method, count in stats_after["calls"].items()
+        if count - stats_before["calls"].get(method, 0)
+    }
+    return {
+        "updates": len(updates),
+        "processed": len(handler_times),
+        "drained": drained,
+        "send_s": sent,
+        "elapsed_s": elapsed,
+        "throughput": len(handler_times) / elapsed if elapsed else 0.0,
+        "handler": {pct: percentile(handler_times, pct) for pct in (50, 95, 99, 100)},
+        "end_to_end": {pct: percentile(end_to_end, pct) for pct in (50, 95, 99, 100)},
+        "loop_lag": {pct: percentile(lags, pct) for pct in (50, 99, 100)},
+        "api_calls": calls,
+        "api_calls_per_update": sum(calls.values()) / max(1, len(handler_times)),
+        "flood_limited": stats_after["flood_limited"],
+        "error_replies": stats_after["error_replies"] - stats_before["error_replies"],
+        "handler_errors": dict(errors),
+    }
+
+
+def ms(seconds):
+    return f"{seconds * 1000:.1f}"
+
+
+def print_result(result):
+    print(f"updates      {result['processed']}/{result['updates']} processed in {result['elapsed_s']:.2f}s "
+          f"({result['throughput']:.1f}/s, queued in {result['send_s']:.2f}s)"
+          + ("" if result["drained"] else "  [drain timeout]"))
+    for name in ("handler", "end_to_end"):
+        p = result[name]
+        print(f"{name:<12} p50 {ms(p[50])} ms  p95 {ms(p[95])} ms  p99 {ms(p[99])} ms  max {ms(p[100])} ms")
+    lag = result["loop_lag"]
+    print(f"{'loop lag':<12} p50 {ms(lag[50])} ms  p99 {ms(lag[99])} ms  max {ms(lag[100])} ms")
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(result["api_calls"].items()))
+    print(f"{'api calls':<12} {calls} ({result['api_calls_per_update']:.2f} per update)")
+    if result["flood_limited"]:
+        print(f"{'429s':<12} " + ", ".join(f"{m} {c}" for m, c in sorted(result["flood_limited"].items())))
+    print(f"{'errors':<12} {result['error_replies']} error replies, handler exceptions: {result['handler_errors'] or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="recorded Updates (JSON lines) instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=300, help="synthetic updates to send")
+    parser.add_argument("--chats", type=int, default=50, help="distinct synthetic chats/students")
+    parser.add_argument("--mix", default=SYNTHETIC_MIX, help="weights of start/set/check/keyword/plan/chat")
+    parser.add_argument("--fresh", type=float, default=1.0, help="share of /check and keyword updates that skip the cache")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=50, help="updates per second (0 = all at once)")
+    parser.add_argument("--concurrent-updates", type=int, default=None,
+                        help="updates the Application handles at once (default BOT_CONCURRENT_UPDATES)")
+    parser.add_argument("--workers", type=int, default=None, help="queue workers (default QUEUE_WORKERS)")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--scraper", choices=("stub", "portal"), default="stub")
+    parser.add_argument("--scrape-latency", type=float, default=1.0, help="stub: seconds per scrape")
+    parser.add_argument("--scrape-jitter", type=float, default=0.2)
+    parser.add_argument("--scrape-failure-rate", type=float, default=0.0)
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--dates", type=int, default=60, help="class dates on the register page")
+    parser.add_argument("--latency", type=float, default=0.1, help="portal: seconds per portal response")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="seconds per Bot API call")
+    parser.add_argument("--api-jitter", type=float, default=0.01)
+    parser.add_argument("--chat-rate", type=float, default=0.0, help="Bot API messages/s per chat before 429 (0 = off)")
+    parser.add_argument("--global-rate", type=float, default=0.0, help="Bot API messages/s overall before 429 (0 = off)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="also write the result to this file")
+    args = parser.parse_args()
+
+    updates = recorded_updates(args.updates) if args.updates else synthetic_updates(args)
+    telegram_port = free_port()
+    servers = [start_server("bench.fake_telegram", telegram_port, [
+        "--latency", str(args.api_latency), "--jitter", str(args.api_jitter),
+        "--chat-rate", str(args.chat_rate), "--global-rate", str(args.global_rate),
+    ])]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+            os.environ["DATABASE_PATH"] = os.path.join(tmp, "replay.db")
+            if args.scraper == "portal":
+                portal_port = free_port()
+                servers.append(start_server("bench.fake_portal", portal_port, [
+                    "--password", args.password, "--dates", str(args.dates), "--latency", str(args.latency),
+                ]))
+                os.environ.update(PORTAL_BASE_URL=f"http://127.0.0.1:{portal_port}", SCRAPER_ENGINE="http")
+            if args.workers:
+                os.environ["QUEUE_WORKERS"] = str(args.workers)
+            from config import QUEUE_WORKERS, BOT_CONCURRENT_UPDATES
+            args.workers = QUEUE_WORKERS
+            if args.concurrent_updates is None:
+                args.concurrent_updates = max(1, BOT_CONCURRENT_UPDATES)
+            result = asyncio.run(replay(args, updates, telegram_port))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    print_result(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
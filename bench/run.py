@@ -0,0 +1,326 @@
+"""End-to-end throughput/latency benchmark against the local stand-in portal.
+
+Starts ``bench.fake_portal`` in its own process, then runs every combination
+of --driver, --engine and --workers in a fresh child process (so RSS and CPU
+are measured per configuration) and prints p50/p95/p99 latency, throughput,
+error count, peak RSS and CPU seconds.
+
+    python -m bench.run --driver queue http telegram keyword --engine http --workers 1 4 8 \\
+        --requests 200 --concurrency 32 --latency 0.2 --failure-rate 0.01
+
+Drivers:
+    queue     app.fetch_report -> request_queue -> process_queue workers
+    http      POST /attendance on the FastAPI app (needs httpx, see bench/requirements.txt)
+    telegram  the /check handler with a stubbed Telegram message
+    keyword   handle_message with keywords saved through model.save_user
+
+Each request uses ``fresh`` so the report cache doesn't hide the scrape; pass
+--cached to measure cache hits instead.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from types import SimpleNamespace
+
+DRIVERS = ("queue", "http", "telegram", "keyword")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def rss_mib(pid="self"):
+    """Current RSS of a process in MiB (Linux /proc; 0 elsewhere)"""
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def child_pids(pid):
+    """Direct and indirect children (e.g. Chromium and its renderers)"""
+    found = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as fh:
+                found.extend(fh.read().split())
+    except OSError:
+        return []
+    return found + [grandchild for child in found for grandchild in child_pids(child)]
+
+
+async def sample_rss(peaks, interval=0.2):
+    """Track peak RSS of this process and of its children while the run is going"""
+    while True:
+        peaks["self"] = max(peaks["self"], rss_mib())
+        peaks["children"] = max(peaks["children"], sum(rss_mib(pid) for pid in child_pids(os.getpid())))
+        await asyncio.sleep(interval)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# -------------------------------
+# Child process: one configuration
+# -------------------------------
+class FakeMessage:
+    """Just enough of telegram.Message for the handlers: reply_text/edit_text"""
+
+    def __init__(self, text=None, on_edit=None):
+        self.text = text
+        self.on_edit = on_edit
+        self.edits = []
+
+    async def reply_text(self, text, **kwargs):
+        return FakeMessage(on_edit=self.on_edit)
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+        if self.on_edit:
+            self.on_edit(text)
+
+
+async def run_child(args):
+    import app
+    import model
+    from browser_pool import browser_pool
+    from http_engine import http_engine
+
+    app.init_storage()
+    await app.warm_engine()
+    workers = [asyncio.create_task(app.process_queue(i)) for i in range(args.workers)]
+    usernames = [f"BENCH{i:04d}" for i in range(args.users)]
+    fresh_suffix = "" if args.cached else " fresh"
+
+    if args.driver == "keyword":
+        for i, username in enumerate(usernames):
+            model.save_user(str(i), username, args.password, f"kw{i}")
+        await model.load_keyword_index_async()
+
+    api_client = None
+    if args.driver == "http":
+        import httpx
+        api_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app.create_fastapi_app()), base_url="http://bench", timeout=None
+        )
+
+    async def one_request(i):
+        index = i % len(usernames)
+        username = usernames[index]
+        if args.driver == "queue":
+            report = json.loads(await app.fetch_report(username, args.password, fresh=not args.cached))
+            return "error" not in report
+        if args.driver == "http":
+            resp = await api_client.post(
+                "/attendance", json={"username": username, "password": args.password, "fresh": not args.cached}
+            )
+            return resp.status_code == 200 and "error" not in resp.json()
+
+        edits = []
+        message = FakeMessage(on_edit=edits.append)
+        if args.driver == "telegram":
+            message.text = f"/check {username} {args.password}{fresh_suffix}"
+            update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=index))
+            context = SimpleNamespace(args=message.text.split()[1:])
+            await app.check_attendance(update, context)
+        else:
+            message.text = f"kw{index}{fresh_suffix}"
+            update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=index))
+            await app.handle_message(update, SimpleNamespace(args=[]))
+        return bool(edits) and not edits[-1].startswith("❌")
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def timed(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await one_request(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    peaks = {"self": 0.0, "children": 0.0}
+    sampler = asyncio.create_task(sample_rss(peaks))
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    sampler.cancel()
+
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    if api_client is not None:
+        await api_client.aclose()
+    await http_engine.stop()
+    await browser_pool.stop()
+
+    cpu = sum(
+        (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+        for before, after in zip(cpu_before, cpu_after)
+    )
+    return {
+        "driver": args.driver,
+        "engine": args.engine,
+        "workers": args.workers,
+        "requests": args.requests,
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "throughput": args.requests / elapsed if elapsed else 0.0,
+        "rss_mib": peaks["self"],
+        "children_rss_mib": peaks["children"],
+        "cpu_s": cpu,
+    }
+
+
+# -------------------------------
+# Parent process: portal + matrix
+# -------------------------------
+def start_portal(args, port):
+    command = [
+        sys.executable, "-m", "bench.fake_portal",
+        "--port", str(port),
+        "--password", args.password,
+        "--dates", str(args.dates),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--failure-rate", str(args.failure_rate),
+    ]
+    portal = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=1).read()
+            return portal
+        except OSError:
+            time.sleep(0.1)
+    portal.kill()
+    raise SystemExit("Fake portal did not start")
+
+
+def portal_stats(port):
+    return json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=5).read())
+
+
+def run_matrix(args):
+    port = free_port()
+    portal = start_portal(args, port)
+    results = []
+    try:
+        for driver, engine, workers in itertools.product(args.driver, args.engine, args.workers):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(
+                    os.environ,
+                    PORTAL_BASE_URL=f"http://127.0.0.1:{port}",
+                    SCRAPER_ENGINE=engine,
+                    # Every driver is one client (127.0.0.1 / a few chats); the per-client limit would just reject it
+                    RATE_LIMIT_PER_MINUTE="0",
+                    QUEUE_WORKERS=str(workers),
+                    DATABASE_PATH=os.path.join(tmp, "bench.db"),
+                )
+                command = [
+                    sys.executable, "-m", "bench.run", "--child",
+                    "--driver", driver, "--engine", engine, "--workers", str(workers),
+                    "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                    "--users", str(args.users), "--password", args.password,
+                ] + (["--cached"] if args.cached else [])
+                before = portal_stats(port)
+                output = subprocess.run(command, env=env, capture_output=True, text=True)
+                if output.returncode != 0:
+                    print(output.stderr, file=sys.stderr)
+                    raise SystemExit(f"{driver}/{engine}/{workers} workers failed")
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                after = portal_stats(port)
+                result["portal_requests"] = after["requests"] - before["requests"]
+                result["portal_logins"] = after["logins"] - before["logins"]
+                results.append(result)
+                print_row(result)
+    finally:
+        portal.terminate()
+        portal.wait()
+    return results
+
+
+def print_header():
+    print(
+        f"{'driver':<9} {'engine':<10} {'wrk':>3} {'reqs':>5} {'err':>4} {'p50 s':>7} {'p95 s':>7} "
+        f"{'p99 s':>7} {'req/s':>7} {'RSS MiB':>8} {'child MiB':>9} {'CPU s':>6} {'portal':>6} {'logins':>6}"
+    )
+
+
+def print_row(r):
+    print(
+        f"{r['driver']:<9} {r['engine']:<10} {r['workers']:>3} {r['requests']:>5} {r['errors']:>4} "
+        f"{r['p50']:>7.3f} {r['p95']:>7.3f} {r['p99']:>7.3f} {r['throughput']:>7.1f} "
+        f"{r['rss_mib']:>8.1f} {r['children_rss_mib']:>9.1f} {r['cpu_s']:>6.2f} "
+        f"{r['portal_requests']:>6} {r['portal_logins']:>6}",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--driver", nargs="+", choices=DRIVERS, default=["queue"])
+    parser.add_argument("--engine", nargs="+", choices=("http", "playwright"), default=["http"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[3])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--users", type=int, default=50, help="distinct accounts requests are spread over")
+    parser.add_argument("--cached", action="store_true", help="allow report cache hits")
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--dates", type=int, default=60, help="class dates on the register page")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.driver, args.engine, args.workers = args.driver[0], args.engine[0], args.workers[0]
+        print(json.dumps(asyncio.run(run_child(args))))
+        return
+
+    print_header()
+    results = run_matrix(args)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    # A run with errors is mostly measuring how fast requests fail
+    clean = [r for r in results if not r["errors"]]
+    if results and not clean:
+        print("\nEvery run had errors; no best throughput")
+    if clean:
+        best = max(clean, key=lambda r: r["throughput"])
+        print(f"\nBest throughput: {best['driver']}/{best['engine']}/{best['workers']} workers "
+              f"({best['throughput']:.1f} req/s, p95 {best['p95']:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
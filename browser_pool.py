@@ -0,0 +1,284 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+from urllib.parse import urlparse
+
+import metrics
+from config import (
+    BROWSER_POOL_SIZE,
+    BROWSER_HEALTH_INTERVAL,
+    BROWSER_HEADLESS,
+    BROWSER_MAX_JOBS,
+    BROWSER_MAX_RSS_MB,
+    BLOCK_RESOURCES,
+    BLOCKED_RESOURCE_TYPES,
+    PORTAL_BASE_URL,
+)
+from resource_governor import resource_governor, MB
+
+logger = logging.getLogger(__name__)
+
+PORTAL_HOST = urlparse(PORTAL_BASE_URL).hostname
+
+
+class PageTraffic:
+    """Routing layer and request/byte accounting for one BrowserContext"""
+
+    def __init__(self, block=BLOCK_RESOURCES):
+        self.block = block
+        self.loaded = 0
+        self.blocked = 0
+        self.bytes = 0
+
+    def should_block(self, request) -> bool:
+        if request.resource_type in BLOCKED_RESOURCE_TYPES:
+            return True
+        # encryptJSText/setValue live in the portal's own scripts; anything else is analytics
+        return request.resource_type == "script" and urlparse(request.url).hostname != PORTAL_HOST
+
+    async def route(self, route):
+        if self.should_block(route.request):
+            self.blocked += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def on_request_finished(self, request):
+        self.loaded += 1
+        with suppress(Exception):
+            sizes = await request.sizes()
+            self.bytes += sizes["responseBodySize"] + sizes["responseHeadersSize"]
+
+    async def attach(self, context):
+        if self.block:
+            await context.route("**/*", self.route)
+        context.on("requestfinished", self.on_request_finished)
+
+    def report(self):
+        """Log and record this context's traffic; "before" is what loading without blocking would request"""
+        logger.info(
+            f"Page traffic: {self.loaded} requests / {self.bytes / 1024:.1f} KiB loaded, "
+            f"{self.blocked} blocked ({self.loaded + self.blocked} requests without blocking)"
+        )
+        metrics.inc("portal_requests_loaded", self.loaded)
+        metrics.inc("portal_requests_blocked", self.blocked)
+        metrics.inc("portal_bytes_loaded", self.bytes)
+
+
+@asynccontextmanager
+async def context_page(browser, storage_state=None):
+    """Yield a page in a new, routed BrowserContext and close the context afterwards"""
+    context = await browser.new_context(storage_state=storage_state)
+    traffic = PageTraffic()
+    try:
+        await traffic.attach(context)
+        yield await context.new_page()
+    finally:
+        with suppress(Exception):
+            await context.close()
+        traffic.report()
+
+
+class BrowserPool:
+    """Keeps warm Chromium processes and hands out isolated contexts per job
+
+    Long-lived Chromium processes grow, so a browser is recycled after
+    ``max_jobs`` jobs or when the browsers together use more than ``max_rss_mb``
+    each: a fresh one takes over the slot and the old one is closed once its
+    open pages finish.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, health_interval=BROWSER_HEALTH_INTERVAL,
+                 max_jobs=BROWSER_MAX_JOBS, max_rss_mb=BROWSER_MAX_RSS_MB):
+        self.size = max(1, size)
+        self.health_interval = health_interval
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * MB
+        self.relaunches = 0
+        self.recycles = 0
+        self._playwright = None
+        self._browsers = [None] * self.size
+        self._active = [0] * self.size
+        self._jobs = [0] * self.size
+        self._pages = {}
+        self._retiring = set()
+        self._recycling = set()
+        self._background = set()
+        self._launched = [False] * self.size
+        self._locks = [asyncio.Lock() for _ in range(self.size)]
+        self._health_task = None
+
+    @property
+    def running(self):
+        return self._playwright is not None
+
+    async def start(self):
+        if self.running:
+            return
+        # Imported here so processes that never launch Chromium don't pay for Playwright
+        from playwright.async_api import async_playwright
+
+        self._playwright = await async_playwright().start()
+        for slot in range(self.size):
+            await self._ensure_browser(slot)
+        await resource_governor.start()
+        self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Browser pool started with {self.size} browser(s)")
+
+    async def stop(self):
+        if not self.running:
+            return
+        if self._health_task:
+            self._health_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._health_task
+            self._health_task = None
+        for slot, browser in enumerate(self._browsers):
+            if browser is not None:
+                with suppress(Exception):
+                    await browser.close()
+            self._browsers[slot] = None
+            self._launched[slot] = False
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        for browser in list(self._retiring):
+            with suppress(Exception):
+                await browser.close()
+        self._retiring.clear()
+        self._pages.clear()
+        await self._playwright.stop()
+        self._playwright = None
+        logger.info("Browser pool stopped")
+
+    async def _launch(self, slot):
+        with metrics.span("browser_launch"):
+            browser = await self._playwright.chromium.launch(headless=BROWSER_HEADLESS)
+        browser.on("disconnected", lambda _: self._mark_dead(slot, browser))
+        return browser
+
+    def _mark_dead(self, slot, browser):
+        # Only forget the slot if it still points at the browser that died
+        if self._browsers[slot] is browser:
+            logger.warning(f"Browser in slot {slot} disconnected")
+            self._browsers[slot] = None
+
+    async def _ensure_browser(self, slot):
+        """Return a connected browser for the slot, relaunching it if it crashed"""
+        async with self._locks[slot]:
+            browser = self._browsers[slot]
+            if browser is not None and browser.is_connected():
+                return browser
+            if self._launched[slot]:
+                self.relaunches += 1
+                logger.warning(f"Relaunching browser in slot {slot}")
+            if browser is not None:
+                with suppress(Exception):
+                    await browser.close()
+            self._browsers[slot] = await self._launch(slot)
+            self._jobs[slot] = 0
+            self._launched[slot] = True
+            return self._browsers[slot]
+
+    async def recycle(self, slot, reason):
+        """Swap a fresh browser into the slot; the old one finishes its pages first"""
+        if slot in self._recycling:
+            return
+        self._recycling.add(slot)
+        await self._swap(slot, reason)
+
+    async def _swap(self, slot, reason):
+        try:
+            async with self._locks[slot]:
+                old = self._browsers[slot]
+                self._browsers[slot] = await self._launch(slot)
+                self._jobs[slot] = 0
+                self._launched[slot] = True
+        finally:
+            self._recycling.discard(slot)
+        self.recycles += 1
+        metrics.inc("browser_recycles")
+        logger.info(f"Recycled browser in slot {slot} ({reason})")
+        if old is not None:
+            self._retiring.add(old)
+            if not self._pages.get(old):
+                await self._retire(old)
+
+    async def _retire(self, browser):
+        self._retiring.discard(browser)
+        self._pages.pop(browser, None)
+        with suppress(Exception):
+            await browser.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for slot in range(self.size):
+                try:
+                    await self._ensure_browser(slot)
+                except Exception as e:
+                    logger.error(f"Browser health check failed for slot {slot}: {e}")
+            try:
+                await self._check_memory()
+            except Exception as e:
+                logger.error(f"Browser memory check failed: {e}")
+
+    async def _check_memory(self):
+        """Recycle the most-used browser while the pool is over its RSS budget"""
+        if not self.max_rss or self._retiring:
+            return
+        resource_governor.sample()
+        rss = resource_governor.browser_rss
+        if rss > self.max_rss * self.size:
+            slot = max(range(self.size), key=lambda i: self._jobs[i])
+            await self.recycle(slot, f"browsers at {rss / MB:.0f} MiB")
+
+    def health(self):
+        return {
+            "size": self.size,
+            "connected": sum(1 for b in self._browsers if b is not None and b.is_connected()),
+            "active_pages": sum(self._active),
+            "jobs": list(self._jobs),
+            "relaunches": self.relaunches,
+            "recycles": self.recycles,
+            "retiring": len(self._retiring),
+        }
+
+    @asynccontextmanager
+    async def page(self, storage_state=None):
+        """Yield a page in a fresh BrowserContext; only the context is torn down afterwards
+
+        ``storage_state`` seeds the context with a previously saved portal login.
+        """
+        if not self.running:
+            raise RuntimeError("Browser pool is not running")
+        slot = min(range(self.size), key=lambda i: self._active[i])
+        self._active[slot] += 1
+        browser = None
+        try:
+            browser = await self._ensure_browser(slot)
+            self._pages[browser] = self._pages.get(browser, 0) + 1
+            self._jobs[slot] += 1
+            async with context_page(browser, storage_state) as page:
+                yield page
+        finally:
+            self._active[slot] -= 1
+            if browser is not None:
+                # stop() may have cleared the books while this page was still open
+                open_pages = self._pages.get(browser, 0) - 1
+                if open_pages > 0:
+                    self._pages[browser] = open_pages
+                elif browser in self._retiring:
+                    await self._retire(browser)
+                else:
+                    self._pages.pop(browser, None)
+                if (self.max_jobs and self._jobs[slot] >= self.max_jobs
+                        and browser is self._browsers[slot] and slot not in self._recycling):
+                    # Off the caller's path: its result is ready, the relaunch isn't its problem
+                    self._recycling.add(slot)
+                    task = asyncio.create_task(self._swap(slot, f"{self._jobs[slot]} jobs"))
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+
+
+browser_pool = BrowserPool()
@@ -0,0 +1,179 @@
+"""Runtime settings, overridable through environment variables."""
+import os
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# -------------------------------
+# Browser pool
+# -------------------------------
+# Number of long-lived Chromium processes kept warm for scraping
+BROWSER_POOL_SIZE = _env_int("BROWSER_POOL_SIZE", 1)
+# Seconds between background health checks of the pooled browsers
+BROWSER_HEALTH_INTERVAL = _env_float("BROWSER_HEALTH_INTERVAL", 30)
+BROWSER_HEADLESS = _env_bool("BROWSER_HEADLESS", True)
+
+# -------------------------------
+# Memory governor
+# -------------------------------
+# Concurrent Playwright pages are capped by available memory: each is assumed to
+# cost MEMORY_PER_PAGE_MB, and MEMORY_RESERVE_MB is always left free
+MEMORY_PER_PAGE_MB = _env_float("MEMORY_PER_PAGE_MB", 120)
+MEMORY_RESERVE_MB = _env_float("MEMORY_RESERVE_MB", 300)
+MAX_CONCURRENT_PAGES = _env_int("MAX_CONCURRENT_PAGES", 8)
+# Seconds between RSS samples of the app and its browser processes
+MEMORY_CHECK_INTERVAL = _env_float("MEMORY_CHECK_INTERVAL", 5)
+# A pooled browser is replaced after this many jobs, or when the browsers' RSS
+# exceeds this per browser (0 disables either)
+BROWSER_MAX_JOBS = _env_int("BROWSER_MAX_JOBS", 200)
+BROWSER_MAX_RSS_MB = _env_float("BROWSER_MAX_RSS_MB", 800)
+
+# -------------------------------
+# Request queue
+# -------------------------------
+# Number of concurrent queue workers (each runs one scrape at a time)
+QUEUE_WORKERS = _env_int("QUEUE_WORKERS", 3)
+# Jobs waiting beyond this are refused (HTTP 429) instead of piling up during outages
+QUEUE_MAX_SIZE = _env_int("QUEUE_MAX_SIZE", 500)
+# Per-client token bucket for scrapes (cache hits are free); 0 disables
+RATE_LIMIT_PER_MINUTE = _env_float("RATE_LIMIT_PER_MINUTE", 6)
+RATE_LIMIT_BURST = _env_float("RATE_LIMIT_BURST", 3)
+# Accounts from one POST /attendance/batch in the queue at once, and the most one batch may hold
+BATCH_CONCURRENCY = _env_int("BATCH_CONCURRENCY", 4)
+BATCH_MAX_ACCOUNTS = _env_int("BATCH_MAX_ACCOUNTS", 500)
+# Seconds a single attendance job may run before it is abandoned
+JOB_TIMEOUT = _env_float("JOB_TIMEOUT", 60)
+# Seconds from enqueue after which a request is given up on, queued or running
+# (POST /attendance may ask for less with "timeout")
+JOB_DEADLINE = _env_float("JOB_DEADLINE", 120)
+
+# -------------------------------
+# Telegram intake
+# -------------------------------
+# "polling" (background thread) or "webhook" (updates POSTed to the FastAPI app)
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").strip().lower()
+# Public https base URL; when set, the webhook is registered with Telegram at startup
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Required in webhook mode; Telegram echoes it in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Updates the bot handles at once; each /check or keyword handler waits for its scrape,
+# so this must comfortably exceed QUEUE_WORKERS or the queue never fills
+BOT_CONCURRENT_UPDATES = _env_int("BOT_CONCURRENT_UPDATES", 256)
+
+# -------------------------------
+# Portal / scraper engine
+# -------------------------------
+PORTAL_BASE_URL = os.getenv("PORTAL_BASE_URL", "https://webprosindia.com/vignanit").rstrip("/")
+# "playwright" drives a real browser; "http" posts the login form directly and
+# falls back to Playwright if the portal answers with something unexpected
+SCRAPER_ENGINE = os.getenv("SCRAPER_ENGINE", "playwright").strip().lower()
+# Key/IV the portal's encryptJSText() uses for AES-CBC password encryption
+PORTAL_AES_KEY = os.getenv("PORTAL_AES_KEY", "8701661282118308")
+# Connections kept open to the portal by the HTTP engine
+HTTP_POOL_SIZE = _env_int("HTTP_POOL_SIZE", 20)
+HTTP_TIMEOUT = _env_float("HTTP_TIMEOUT", 20)
+
+# -------------------------------
+# Portal health: adaptive timeouts, retries, circuit breaker
+# -------------------------------
+# Per-request timeout is this multiple of the recent p95 portal latency, clamped to
+# [PORTAL_TIMEOUT_MIN, HTTP_TIMEOUT / PAGE_TIMEOUT]
+PORTAL_TIMEOUT_FACTOR = _env_float("PORTAL_TIMEOUT_FACTOR", 4)
+PORTAL_TIMEOUT_MIN = _env_float("PORTAL_TIMEOUT_MIN", 2)
+# Extra attempts per scrape after a portal failure, and the share of scrapes that may retry
+PORTAL_RETRIES = _env_int("PORTAL_RETRIES", 2)
+PORTAL_RETRY_BUDGET = _env_float("PORTAL_RETRY_BUDGET", 0.2)
+# Consecutive portal failures that open the circuit, and seconds before a probe is let through
+PORTAL_FAILURE_THRESHOLD = _env_int("PORTAL_FAILURE_THRESHOLD", 5)
+PORTAL_OPEN_SECONDS = _env_float("PORTAL_OPEN_SECONDS", 30)
+
+# -------------------------------
+# Portal session cache
+# -------------------------------
+# Seconds a logged-in portal session is reused before logging in again
+SESSION_TTL = _env_float("SESSION_TTL", 900)
+SESSION_CACHE_SIZE = _env_int("SESSION_CACHE_SIZE", 1000)
+
+# -------------------------------
+# Report cache
+# -------------------------------
+# Seconds a scraped report is served as-is
+REPORT_TTL = _env_float("REPORT_TTL", 1800)
+# Older reports (up to this age) are still served immediately while a refresh runs
+REPORT_MAX_STALE = _env_float("REPORT_MAX_STALE", 86400)
+REPORT_CACHE_SIZE = _env_int("REPORT_CACHE_SIZE", 5000)
+
+# -------------------------------
+# Attendance math / planner
+# -------------------------------
+# Minimum attendance percentage students have to maintain
+ATTENDANCE_THRESHOLD = _env_float("ATTENDANCE_THRESHOLD", 75)
+# Upcoming-class scenarios the planner evaluates by default (0..N)
+PLAN_MAX_CLASSES = _env_int("PLAN_MAX_CLASSES", 20)
+
+# -------------------------------
+# Playwright page loading
+# -------------------------------
+# Abort requests the scrape doesn't need (images, CSS, fonts, third-party scripts)
+BLOCK_RESOURCES = _env_bool("BLOCK_RESOURCES", True)
+BLOCKED_RESOURCE_TYPES = frozenset(
+    t.strip() for t in os.getenv("BLOCKED_RESOURCE_TYPES", "image,stylesheet,font,media,manifest").split(",") if t.strip()
+)
+# Milliseconds to wait for the selectors each portal page is expected to show
+PAGE_TIMEOUT = _env_int("PAGE_TIMEOUT", 10000)
+
+# -------------------------------
+# Storage
+# -------------------------------
+DATABASE_PATH = os.getenv("DATABASE_PATH", "users.db")
+# Threads (each with its own persistent SQLite connection) serving async DB calls
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 4)
+# How stale (s) the keyword index may be when it turns away an ordinary chat message;
+# lookups of a saved account always re-check it (other uvicorn workers may have saved users)
+KEYWORD_INDEX_MAX_AGE = _env_float("KEYWORD_INDEX_MAX_AGE", 1)
+
+# -------------------------------
+# Scheduled prefetch
+# -------------------------------
+# Local-time windows when saved users' reports are refreshed ahead of demand,
+# e.g. "12:45-13:30,16:30-17:30"; empty disables prefetching
+PREFETCH_WINDOWS = os.getenv("PREFETCH_WINDOWS", "16:30-17:30")
+# Prefetch scrapes allowed in the queue at once (the rest is left for live requests)
+PREFETCH_CONCURRENCY = _env_int("PREFETCH_CONCURRENCY", 1)
+# Random delay (seconds) before each prefetch so the portal isn't hit in bursts
+PREFETCH_JITTER = _env_float("PREFETCH_JITTER", 20)
+
+# -------------------------------
+# Change notifications
+# -------------------------------
+# Local-time windows when subscribers (/notify on) are checked for new marks;
+# empty disables notifications
+NOTIFY_WINDOWS = os.getenv("NOTIFY_WINDOWS", "17:30-18:30")
+# Notification scrapes allowed in the queue at once
+NOTIFY_CONCURRENCY = _env_int("NOTIFY_CONCURRENCY", 1)
+
+# -------------------------------
+# Durable job queue / worker fleet
+# -------------------------------
+# "memory" scrapes inside the app process; "sqlite" hands jobs to `python worker.py` processes
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "memory").strip().lower()
+JOB_DATABASE_PATH = os.getenv("JOB_DATABASE_PATH", "jobs.db")
+# A leased job whose worker stops heartbeating is retried after this many seconds
+JOB_LEASE_SECONDS = _env_float("JOB_LEASE_SECONDS", 30)
+JOB_MAX_ATTEMPTS = _env_int("JOB_MAX_ATTEMPTS", 3)
+# How often the app checks for finished jobs, and how long results are kept
+JOB_POLL_INTERVAL = _env_float("JOB_POLL_INTERVAL", 0.2)
+JOB_RESULT_TTL = _env_float("JOB_RESULT_TTL", 3600)
+# Jobs each worker process scrapes at once
+WORKER_CONCURRENCY = _env_int("WORKER_CONCURRENCY", 2)
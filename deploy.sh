@@ -43,5 +43,13 @@ playwright install-deps
 echo "Installing Playwright browsers..."
 playwright install
 
+if [ "${QUEUE_BACKEND:-memory}" = "sqlite" ]; then
+    echo "Starting ${WORKER_PROCESSES:=$(nproc)} scraper worker processes..."
+    python worker.py --processes "$WORKER_PROCESSES" &
+    WORKER_PID=$!
+    # Let running scrapes finish when the app stops
+    trap 'kill -TERM $WORKER_PID; wait $WORKER_PID' EXIT
+fi
+
 echo "Starting the FastAPI application with Uvicorn..."
 uvicorn app:app_api --host 0.0.0.0 --port 5000 --log-level info
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""Attendance history: compact per-day snapshots of every parsed register.
+
+Each register is reduced to, per class date, one array of present counts and
+one of held counts (one uint16 per subject, stored as BLOBs). A snapshot row
+records when the register was seen, its subject order, a content hash and the
+digest of the credentials that fetched it; only the days whose arrays changed
+since the previous snapshot are written, so a daily check usually adds a single
+day row. Trend queries only read days written under the caller's digest, so
+saving someone else's username with a wrong password never shows their history.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import time
+from array import array
+
+from config import ATTENDANCE_THRESHOLD
+from model import get_db, run_db
+
+logger = logging.getLogger(__name__)
+
+CREATE_SNAPSHOTS_SQL = '''
+        CREATE TABLE IF NOT EXISTS history_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            taken_at REAL NOT NULL,
+            subjects TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            changed_days INTEGER NOT NULL,
+            credential_digest TEXT
+        )
+        '''
+ADD_DIGEST_SQL = 'ALTER TABLE history_snapshots ADD COLUMN credential_digest TEXT'
+CREATE_SNAPSHOTS_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS history_snapshots_user ON history_snapshots (username, id)'
+CREATE_DAYS_SQL = '''
+        CREATE TABLE IF NOT EXISTS history_days (
+            username TEXT NOT NULL,
+            day TEXT NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            present BLOB NOT NULL,
+            held BLOB NOT NULL,
+            PRIMARY KEY (username, day)
+        ) WITHOUT ROWID
+        '''
+LAST_SNAPSHOT_SQL = 'SELECT id, subjects, content_hash, credential_digest FROM history_snapshots WHERE username = ? ORDER BY id DESC LIMIT 1'
+INSERT_SNAPSHOT_SQL = '''
+        INSERT INTO history_snapshots (username, taken_at, subjects, content_hash, changed_days, credential_digest)
+        VALUES (?, ?, ?, ?, ?, ?)
+        '''
+USER_DAYS_SQL = 'SELECT day, snapshot_id, present, held FROM history_days WHERE username = ? ORDER BY day'
+UPSERT_DAY_SQL = 'INSERT OR REPLACE INTO history_days (username, day, snapshot_id, present, held) VALUES (?, ?, ?, ?, ?)'
+SNAPSHOT_SUBJECTS_SQL = 'SELECT id, subjects FROM history_snapshots WHERE username = ? AND credential_digest = ?'
+
+
+def register_day(label: str, seen: datetime.date) -> datetime.date:
+    """"16/10" -> the most recent such date on or before the day the register was seen"""
+    day, month = (int(part) for part in label.split("/"))
+    candidate = datetime.date(seen.year, month, day)
+    if candidate > seen + datetime.timedelta(days=1):
+        candidate = candidate.replace(year=seen.year - 1)
+    return candidate
+
+
+def encode_days(daily: dict, seen: datetime.date) -> dict:
+    """Fold the parsed register into {iso_day: (present_bytes, held_bytes)}"""
+    subject_count = len(daily['subjects'])
+    days = {}
+    for column, label in enumerate(daily['dates']):
+        try:
+            day = register_day(label, seen).isoformat()
+        except ValueError:
+            continue
+        present, held = days.setdefault(day, (array('H', bytes(2 * subject_count)), array('H', bytes(2 * subject_count))))
+        for subject in range(subject_count):
+            present[subject] += daily['present'][subject][column]
+            held[subject] += daily['held'][subject][column]
+    return {day: (present.tobytes(), held.tobytes()) for day, (present, held) in days.items() if any(held)}
+
+
+class HistoryStore:
+    """Snapshot writer and trend queries over the per-day attendance arrays"""
+
+    def init(self):
+        with get_db() as db:
+            db.execute(CREATE_SNAPSHOTS_SQL)
+            db.execute(CREATE_SNAPSHOTS_INDEX_SQL)
+            db.execute(CREATE_DAYS_SQL)
+            columns = {row[1] for row in db.execute('PRAGMA table_info(history_snapshots)')}
+            if 'credential_digest' not in columns:
+                # Older snapshots have no digest and stay hidden until the next check rewrites their days
+                db.execute(ADD_DIGEST_SQL)
+            db.commit()
+
+    def record(self, username: str, credential_digest: str, daily: dict, taken_at: float = None):
+        """Store a parsed register fetched with ``credential_digest``; returns the new snapshot id, or None if nothing changed"""
+        taken_at = taken_at or time.time()
+        days = encode_days(daily, datetime.date.fromtimestamp(taken_at))
+        subjects = json.dumps(daily['subjects'])
+        digest = hashlib.sha1(subjects.encode())
+        for day in sorted(days):
+            digest.update(day.encode() + days[day][0] + days[day][1])
+        content_hash = digest.hexdigest()
+
+        with get_db() as db:
+            last = db.execute(LAST_SNAPSHOT_SQL, (username,)).fetchone()
+            if last is not None and last[2] == content_hash and last[3] == credential_digest:
+                return None
+
+            stored = {}
+            if last is not None and last[1] == subjects and last[3] == credential_digest:
+                # Same subject order: unchanged day arrays can be compared byte for byte
+                stored = {day: (present, held) for day, _, present, held in db.execute(USER_DAYS_SQL, (username,))}
+            changed = {day: arrays for day, arrays in days.items() if stored.get(day) != arrays}
+
+            cursor = db.execute(INSERT_SNAPSHOT_SQL, (username, taken_at, subjects, content_hash, len(changed), credential_digest))
+            snapshot_id = cursor.lastrowid
+            db.executemany(
+                UPSERT_DAY_SQL,
+                [(username, day, snapshot_id, present, held) for day, (present, held) in changed.items()]
+            )
+            db.commit()
+        logger.info(f"History snapshot {snapshot_id} for {username}: {len(changed)} changed day(s)")
+        return snapshot_id
+
+    def days(self, username: str, credential_digest: str):
+        """[(date, {subject: (present, held)})] for every class day recorded under these credentials, oldest first"""
+        with get_db() as db:
+            snapshot_subjects = {
+                sid: json.loads(names)
+                for sid, names in db.execute(SNAPSHOT_SUBJECTS_SQL, (username, credential_digest))
+            }
+            rows = db.execute(USER_DAYS_SQL, (username,)).fetchall()
+        result = []
+        for day, snapshot_id, present_bytes, held_bytes in rows:
+            if snapshot_id not in snapshot_subjects:
+                # Written by a scrape under other credentials
+                continue
+            present, held = array('H'), array('H')
+            present.frombytes(present_bytes)
+            held.frombytes(held_bytes)
+            names = snapshot_subjects[snapshot_id]
+            result.append((
+                datetime.date.fromisoformat(day),
+                {name: (p, h) for name, p, h in zip(names, present, held) if h}
+            ))
+        return result
+
+    def overall_trend(self, username: str, credential_digest: str, weeks: int = 4):
+        """Cumulative overall percentage after each class day in the last ``weeks`` weeks"""
+        since = datetime.date.today() - datetime.timedelta(weeks=weeks)
+        present = held = 0
+        points = []
+        for day, counts in self.days(username, credential_digest):
+            present += sum(p for p, _ in counts.values())
+            held += sum(h for _, h in counts.values())
+            if day >= since and held:
+                points.append({"day": day.isoformat(), "present": present, "held": held,
+                               "percentage": present / held * 100})
+        return points
+
+    def subject_trends(self, username: str, credential_digest: str, weeks: int = 4,
+                       threshold: float = ATTENDANCE_THRESHOLD):
+        """Per subject: percentage now, at the start of the window and within the window
+
+        ``below`` flags subjects that are under the threshold now, or whose classes
+        in the window are (i.e. are trending below it).
+        """
+        since = datetime.date.today() - datetime.timedelta(weeks=weeks)
+        totals = {}
+        for day, counts in self.days(username, credential_digest):
+            for name, (p, h) in counts.items():
+                t = totals.setdefault(name, [0, 0, 0, 0])  # present, held, window present, window held
+                t[0] += p
+                t[1] += h
+                if day >= since:
+                    t[2] += p
+                    t[3] += h
+
+        def pct(p, h):
+            return p / h * 100 if h else None
+
+        trends = []
+        for name, (present, held, window_present, window_held) in totals.items():
+            current = pct(present, held)
+            window = pct(window_present, window_held)
+            trends.append({
+                "name": name,
+                "percentage": current,
+                "start_percentage": pct(present - window_present, held - window_held),
+                "window_percentage": window,
+                "below": current < threshold or (window is not None and window < threshold),
+            })
+        return trends
+
+    def trending_below(self, username: str, credential_digest: str, weeks: int = 4,
+                       threshold: float = ATTENDANCE_THRESHOLD):
+        return sorted(
+            (t for t in self.subject_trends(username, credential_digest, weeks, threshold) if t["below"]),
+            key=lambda t: t["window_percentage"] if t["window_percentage"] is not None else t["percentage"]
+        )
+
+    # -------------------------------
+    # Async wrappers (on model's DB thread pool, like get_user_async)
+    # -------------------------------
+    async def overall_trend_async(self, username: str, credential_digest: str, weeks: int = 4):
+        return await run_db(self.overall_trend, username, credential_digest, weeks)
+
+    async def subject_trends_async(self, username: str, credential_digest: str, weeks: int = 4,
+                                   threshold: float = ATTENDANCE_THRESHOLD):
+        return await run_db(self.subject_trends, username, credential_digest, weeks, threshold)
+
+
+history_store = HistoryStore()
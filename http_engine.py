@@ -0,0 +1,158 @@
+import base64
+import logging
+from contextlib import asynccontextmanager
+
+import lxml.html
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import metrics
+from config import PORTAL_BASE_URL, PORTAL_AES_KEY, HTTP_POOL_SIZE, HTTP_TIMEOUT
+from portal_health import portal_health
+
+logger = logging.getLogger(__name__)
+
+LOGIN_URL = f"{PORTAL_BASE_URL}/Default.aspx"
+REGISTER_URL = f"{PORTAL_BASE_URL}/Academics/studentacadamicregister.aspx?scrid=2"
+# Present on the academic register page only; an expired session lands on the login page instead
+REGISTER_MARKER = "reportHeading2WithBackground"
+
+
+class PortalError(Exception):
+    """The portal answered with something the HTTP engine doesn't understand"""
+
+
+def encrypt_password(password: str, key: str = PORTAL_AES_KEY) -> str:
+    """Python port of the portal's encryptJSText(): AES-128-CBC, PKCS7, key == IV, base64 output"""
+    key_bytes = key.encode()
+    padder = padding.PKCS7(128).padder()
+    data = padder.update(password.encode()) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(key_bytes)).encryptor()
+    return base64.b64encode(encryptor.update(data) + encryptor.finalize()).decode()
+
+
+def build_login_form(html: str, username: str, password: str) -> dict:
+    """Collect the ASP.NET hidden fields and fill in what encryptJSText(2)/setValue(2) would"""
+    doc = lxml.html.fromstring(html)
+    if not doc.forms:
+        raise PortalError("Login form not found")
+    fields = dict(doc.forms[0].form_values())
+    if "__VIEWSTATE" not in fields:
+        raise PortalError("Login form has no __VIEWSTATE")
+
+    fields["txtId2"] = username
+    fields["txtPwd2"] = password
+    fields["hdnpwd2"] = encrypt_password(password)
+    # #imgBtn2 is an image button, so the browser posts the click coordinates
+    fields["imgBtn2.x"] = "0"
+    fields["imgBtn2.y"] = "0"
+    return fields
+
+
+def is_register_page(html: str) -> bool:
+    return bool(html) and REGISTER_MARKER in html
+
+
+def check_login_response(html: str):
+    """Mirror the checks fetch_attendance does on the page after submitting"""
+    doc = lxml.html.fromstring(html)
+    error = doc.get_element_by_id("lblError2", None)
+    if error is not None and error.text_content().strip():
+        logger.warning(f"Login failed: {error.text_content().strip()}")
+        return False, "❌ Invalid Username or Password"
+    if doc.get_element_by_id("divscreens", None) is None:
+        logger.error("Login failed: #divscreens not found")
+        return False, "❌ Authentication Failed"
+    return True, "✅ Logged in successfully"
+
+
+class HttpEngine:
+    """Browserless portal client sharing one pooled connector across per-job sessions
+
+    aiohttp is imported on first use, so the Playwright engine never loads it.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._connector = None
+
+    @property
+    def running(self):
+        return self._connector is not None and not self._connector.closed
+
+    async def start(self):
+        if not self.running:
+            import aiohttp
+
+            self._connector = aiohttp.TCPConnector(limit=self.pool_size)
+
+    async def stop(self):
+        if self.running:
+            await self._connector.close()
+        self._connector = None
+
+    @asynccontextmanager
+    async def session(self, cookies: dict = None):
+        """A ClientSession with its own cookie jar, so students never share a portal login
+
+        ``cookies`` restores a previously exported portal session (see export_cookies).
+        """
+        import aiohttp
+        from yarl import URL
+
+        await self.start()
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+        if cookies:
+            cookie_jar.update_cookies(cookies, response_url=URL(LOGIN_URL))
+        async with aiohttp.ClientSession(
+            connector=self._connector,
+            connector_owner=False,
+            cookie_jar=cookie_jar,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        ) as session:
+            yield session
+
+    @staticmethod
+    def request_timeout():
+        """Per-request timeout following the portal's recent latency (HTTP_TIMEOUT at most)"""
+        import aiohttp
+
+        return aiohttp.ClientTimeout(total=portal_health.http_timeout())
+
+    @staticmethod
+    def export_cookies(session) -> dict:
+        from yarl import URL
+
+        return {name: morsel.value for name, morsel in session.cookie_jar.filter_cookies(URL(LOGIN_URL)).items()}
+
+    async def fetch_attendance(self, session, username, password):
+        """Log in with a plain form post; same return contract as scrapper.fetch_attendance"""
+        with metrics.span("login_page"), portal_health.timed():
+            async with session.get(LOGIN_URL, timeout=self.request_timeout()) as resp:
+                resp.raise_for_status()
+                login_html = await resp.text()
+
+        form = build_login_form(login_html, username, password)
+        with metrics.span("login_submit"), portal_health.timed():
+            async with session.post(LOGIN_URL, data=form, timeout=self.request_timeout()) as resp:
+                resp.raise_for_status()
+                login_response = await resp.text()
+        return check_login_response(login_response)
+
+    async def get_attendance_data(self, session):
+        """Fetch the academic register page; same return contract as scrapper.get_attendance_data"""
+        html = await self.fetch_register_page(session)
+        if not is_register_page(html):
+            raise PortalError("Academic register page has no attendance table")
+        return html, "Data extracted successfully"
+
+    async def fetch_register_page(self, session) -> str:
+        """GET the register page as-is; with an expired session this is the login page"""
+        with metrics.span("register_fetch"), portal_health.timed():
+            async with session.get(REGISTER_URL, timeout=self.request_timeout()) as resp:
+                resp.raise_for_status()
+                return await resp.text()
+
+
+http_engine = HttpEngine()
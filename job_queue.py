@@ -0,0 +1,290 @@
+"""Durable scrape queue shared by the app and `worker.py` processes through SQLite.
+
+The app enqueues (username, password, priority) rows and waits for their result;
+workers lease the most urgent row, heartbeat while scraping and store the result.
+A lease that isn't renewed expires and the job is handed to another worker, up
+to JOB_MAX_ATTEMPTS times.
+
+Several app processes may wait on one row (the same student asking through two
+uvicorn workers), so each row counts its waiters; the job is only withdrawn
+when the last of them, in any process, gives up.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+from config import JOB_DATABASE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL, JOB_RESULT_TTL
+from session_store import credential_digest
+
+logger = logging.getLogger(__name__)
+
+CREATE_JOBS_SQL = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            deadline REAL,
+            waiters INTEGER NOT NULL DEFAULT 0,
+            leased_by TEXT,
+            lease_expires REAL,
+            finished_at REAL,
+            result TEXT
+        )
+        '''
+CREATE_JOBS_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, id)'
+# jobs.db files created before deadlines existed
+ADD_DEADLINE_SQL = 'ALTER TABLE jobs ADD COLUMN deadline REAL'
+ADD_WAITERS_SQL = 'ALTER TABLE jobs ADD COLUMN waiters INTEGER NOT NULL DEFAULT 0'
+PENDING_FOR_USER_SQL = '''
+        SELECT id FROM jobs WHERE username = ? AND digest = ? AND status IN ('queued', 'leased')
+        ORDER BY id LIMIT 1
+        '''
+ENQUEUE_SQL = '''
+        INSERT INTO jobs (username, password, digest, priority, enqueued_at, deadline, waiters)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+        '''
+JOIN_SQL = 'UPDATE jobs SET waiters = waiters + 1 WHERE id = ?'
+PROMOTE_SQL = '''
+        UPDATE jobs SET priority = MIN(priority, ?), deadline = MAX(deadline, ?)
+        WHERE id = ? AND status = 'queued'
+        '''
+LEAVE_SQL = 'UPDATE jobs SET waiters = waiters - 1 WHERE id = ?'
+WAITERS_SQL = 'SELECT waiters FROM jobs WHERE id = ?'
+NEXT_JOB_SQL = '''
+        SELECT id, username, password, attempts, deadline FROM jobs
+        WHERE status = 'queued' OR (status = 'leased' AND lease_expires < ?)
+        ORDER BY priority, id LIMIT 1
+        '''
+LEASE_SQL = "UPDATE jobs SET status = 'leased', leased_by = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?"
+HEARTBEAT_SQL = "UPDATE jobs SET lease_expires = ? WHERE id = ? AND leased_by = ? AND status = 'leased'"
+FINISH_SQL = '''
+        UPDATE jobs SET status = ?, result = ?, finished_at = ?, password = '', lease_expires = NULL
+        WHERE id = ? AND leased_by = ? AND status = 'leased'
+        '''
+EXHAUSTED_SQL = '''
+        UPDATE jobs SET status = 'failed', result = ?, finished_at = ?, password = '', lease_expires = NULL
+        WHERE id = ?
+        '''
+CANCEL_SQL = '''
+        UPDATE jobs SET status = 'cancelled', password = '', finished_at = ?, lease_expires = NULL
+        WHERE id = ? AND status IN ('queued', 'leased')
+        '''
+RELEASE_SQL = "UPDATE jobs SET status = 'queued', leased_by = NULL, lease_expires = NULL WHERE id = ? AND leased_by = ?"
+# Cancelled rows come back too (with a NULL result) so waiters that joined them can re-enqueue
+RESULTS_SQL = "SELECT id, result FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND id IN ({})"
+PURGE_SQL = "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?"
+COUNTS_SQL = 'SELECT status, COUNT(*) FROM jobs GROUP BY status'
+
+EXHAUSTED_RESULT = json.dumps({"error": "Failed to fetch attendance data. Please try again."})
+EXPIRED_RESULT = json.dumps({"error": "The request timed out. Please try again."})
+
+
+class JobStore:
+    """Synchronous queue operations; one autocommit connection per thread"""
+
+    def __init__(self, path: str = JOB_DATABASE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @contextmanager
+    def _db(self, immediate: bool = False):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield db
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def init(self):
+        with self._db(immediate=True) as db:
+            db.execute(CREATE_JOBS_SQL)
+            db.execute(CREATE_JOBS_INDEX_SQL)
+            columns = {row[1] for row in db.execute('PRAGMA table_info(jobs)')}
+            if 'deadline' not in columns:
+                db.execute(ADD_DEADLINE_SQL)
+            if 'waiters' not in columns:
+                db.execute(ADD_WAITERS_SQL)
+
+    def enqueue(self, username: str, password: str, priority: int, deadline: float = None) -> int:
+        """Queue a scrape, or join the same user's job that is still pending; returns the job id
+
+        Either way the caller counts as one of the job's waiters until it gets
+        the result or calls leave(). ``deadline`` (time.time) is when the job
+        stops being worth starting.
+        """
+        digest = credential_digest(username, password)
+        deadline = deadline or time.time() + 365 * 86400
+        with self._db(immediate=True) as db:
+            row = db.execute(PENDING_FOR_USER_SQL, (username, digest)).fetchone()
+            if row is not None:
+                db.execute(JOIN_SQL, (row[0],))
+                db.execute(PROMOTE_SQL, (priority, deadline, row[0]))
+                return row[0]
+            return db.execute(ENQUEUE_SQL, (username, password, digest, priority, time.time(), deadline)).lastrowid
+
+    def lease(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """(job id, username, password, deadline) of the most urgent available job, or None"""
+        now = time.time()
+        with self._db(immediate=True) as db:
+            while True:
+                row = db.execute(NEXT_JOB_SQL, (now,)).fetchone()
+                if row is None:
+                    return None
+                job_id, username, password, attempts, deadline = row
+                if deadline is not None and deadline <= now:
+                    # Whoever asked has given up; drop it without scraping
+                    db.execute(EXHAUSTED_SQL, (EXPIRED_RESULT, now, job_id))
+                    continue
+                if attempts >= max_attempts:
+                    # Its workers kept dying on it; give up instead of taking down another one
+                    db.execute(EXHAUSTED_SQL, (EXHAUSTED_RESULT, now, job_id))
+                    logger.warning(f"Job {job_id} for {username} failed after {attempts} attempts")
+                    continue
+                db.execute(LEASE_SQL, (worker_id, now + lease_seconds, job_id))
+                return job_id, username, password, deadline
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend a lease; False means it was lost (expired and taken by another worker)"""
+        with self._db() as db:
+            return db.execute(HEARTBEAT_SQL, (time.time() + lease_seconds, job_id, worker_id)).rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: str, failed: bool = False) -> bool:
+        with self._db() as db:
+            status = 'failed' if failed else 'done'
+            return db.execute(FINISH_SQL, (status, result, time.time(), job_id, worker_id)).rowcount == 1
+
+    def cancel(self, job_id: int) -> bool:
+        """Withdraw a job nobody waits for; a worker running it loses its lease at the next heartbeat"""
+        with self._db() as db:
+            return db.execute(CANCEL_SQL, (time.time(), job_id)).rowcount == 1
+
+    def leave(self, job_id: int) -> bool:
+        """Stop waiting for a job; the last waiter (in any process) withdraws it. True if it was cancelled"""
+        with self._db(immediate=True) as db:
+            db.execute(LEAVE_SQL, (job_id,))
+            row = db.execute(WAITERS_SQL, (job_id,)).fetchone()
+            if row is None or row[0] > 0:
+                return False
+            return db.execute(CANCEL_SQL, (time.time(), job_id)).rowcount == 1
+
+    def release(self, job_id: int, worker_id: str):
+        """Hand a leased job back untouched (worker shutting down)"""
+        with self._db() as db:
+            db.execute(RELEASE_SQL, (job_id, worker_id))
+
+    def results(self, job_ids) -> dict:
+        """job id -> result JSON for those of ``job_ids`` that have finished"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        with self._db() as db:
+            sql = RESULTS_SQL.format(",".join("?" * len(job_ids)))
+            return dict(db.execute(sql, job_ids).fetchall())
+
+    def purge(self, ttl: float = JOB_RESULT_TTL) -> int:
+        with self._db() as db:
+            return db.execute(PURGE_SQL, (time.time() - ttl,)).rowcount
+
+    def counts(self) -> dict:
+        with self._db() as db:
+            return dict(db.execute(COUNTS_SQL).fetchall())
+
+
+job_store = JobStore()
+
+
+class DurableQueue:
+    """App side: enqueue into the job store and resolve futures as workers finish
+
+    One poll task checks every pending job id with a single query each
+    JOB_POLL_INTERVAL, so waiting costs nothing per request.
+    """
+
+    def __init__(self, store: JobStore = job_store, poll_interval: float = JOB_POLL_INTERVAL):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self._waiters = {}  # job id -> [futures]
+        self._task = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        await self._run(self.store.init)
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    def pending(self) -> int:
+        return len(self._waiters)
+
+    async def scrape(self, username: str, password: str, priority: int, deadline: float = None) -> str:
+        """Enqueue (or join the user's pending job) and wait for a worker's result
+
+        If this waiter is cancelled it leaves the job, and the job is withdrawn
+        from the queue (or aborted by its worker) once no process waits for it.
+        A job cancelled under us anyway is enqueued again.
+        """
+        while True:
+            job_id = await self._run(self.store.enqueue, username, password, priority, deadline)
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(job_id, []).append(future)
+            try:
+                result = await future
+            except asyncio.CancelledError:
+                # Fire and forget since we're being cancelled
+                self._executor.submit(self.store.leave, job_id)
+                raise
+            finally:
+                waiters = self._waiters.get(job_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[job_id]
+            if result is not None:
+                return result
+            metrics.inc("durable_jobs_requeued")
+            logger.info(f"Job {job_id} for {username} was cancelled while we waited; enqueueing again")
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self._waiters:
+                continue
+            try:
+                results = await self._run(self.store.results, list(self._waiters))
+            except sqlite3.Error as e:
+                logger.error(f"Job queue poll failed: {e}")
+                continue
+            for job_id, result in results.items():
+                if result is not None:
+                    metrics.inc("durable_jobs_finished")
+                for future in self._waiters.pop(job_id, []):
+                    if not future.done():
+                        future.set_result(result)
+
+
+durable_queue = DurableQueue()
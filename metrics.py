@@ -0,0 +1,130 @@
+"""In-process counters, gauges and histograms, exported in Prometheus text format."""
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "ecap"
+# Seconds; covers everything from a cache hit to a portal that is about to time out
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+counters = Counter()
+_registry = []
+_lock = threading.Lock()
+
+
+def inc(name: str, value: int = 1):
+    with _lock:
+        counters[name] += value
+
+
+def snapshot() -> dict:
+    with _lock:
+        return dict(counters)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Gauge:
+    """A value that goes up and down, or is read from ``fn`` at scrape time"""
+
+    def __init__(self, name: str, help: str, fn=None):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.fn = fn
+        self.value = 0
+        _registry.append(self)
+
+    def inc(self, value=1):
+        with _lock:
+            self.value += value
+
+    def dec(self, value=1):
+        with _lock:
+            self.value -= value
+
+    def set(self, value):
+        with _lock:
+            self.value = value
+
+    def render(self):
+        value = self.fn() if self.fn else self.value
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            series = {key: (list(b), n, s) for key, (b, n, s) in self._series.items()}
+        for key, (bucket_counts, count, total) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_count{_label_text(key)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {total}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Time spent in each stage of an attendance check (browser_launch, login_page, login_submit, "
+    "register_fetch, parse, format_report, telegram_edit)",
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage into ecap_stage_seconds{stage, outcome}"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage, outcome=outcome)
+        logger.debug(f"span stage={stage} outcome={outcome} seconds={elapsed:.4f}")
+
+
+def render() -> str:
+    """Prometheus text exposition (version 0.0.4) of every metric"""
+    lines = []
+    for name, value in sorted(snapshot().items()):
+        metric = f"{PREFIX}_{name}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
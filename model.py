@@ -1,42 +1,321 @@
+import asyncio
+import logging
 import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+from config import DATABASE_PATH, DB_POOL_SIZE, KEYWORD_INDEX_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# Statements are kept as constants so each connection's statement cache
+# compiles them once and reuses the prepared statement afterwards
+CREATE_USERS_SQL = '''
+        CREATE TABLE IF NOT EXISTS users (
+            phone TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            keyword TEXT NOT NULL
+        )
+        '''
+SAVE_USER_SQL = '''
+        INSERT OR REPLACE INTO users (phone, username, password, keyword)
+        VALUES (?, ?, ?, ?)
+        '''
+GET_USER_SQL = 'SELECT phone, username, password, keyword FROM users WHERE phone = ?'
+GET_USER_BY_KEYWORD_SQL = 'SELECT phone, username, password, keyword FROM users WHERE phone = ? AND keyword = ?'
+ALL_USERS_SQL = 'SELECT phone, username, password, keyword FROM users'
+# Bumped by triggers on every change to users, so each process can tell when its keyword index is stale
+CREATE_USERS_VERSION_SQL = '''
+        CREATE TABLE IF NOT EXISTS users_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        )
+        '''
+INIT_USERS_VERSION_SQL = 'INSERT OR IGNORE INTO users_version (id, version) VALUES (0, 0)'
+CREATE_USERS_VERSION_TRIGGERS_SQL = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS users_version_{event.lower()} AFTER {event} ON users
+        BEGIN UPDATE users_version SET version = version + 1; END
+        '''
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+USERS_VERSION_SQL = 'SELECT version FROM users_version'
+CREATE_ACTIVITY_SQL = '''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            phone TEXT PRIMARY KEY,
+            requests INTEGER NOT NULL DEFAULT 0,
+            last_seen REAL NOT NULL
+        )
+        '''
+RECORD_ACTIVITY_SQL = '''
+        INSERT INTO user_activity (phone, requests, last_seen) VALUES (?, 1, ?)
+        ON CONFLICT(phone) DO UPDATE SET requests = requests + 1, last_seen = excluded.last_seen
+        '''
+ACTIVITY_SQL = 'SELECT phone, requests FROM user_activity'
+CREATE_NOTIFY_SQL = '''
+        CREATE TABLE IF NOT EXISTS notify_state (
+            phone TEXT PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 0,
+            content_hash TEXT,
+            subjects TEXT
+        )
+        '''
+SET_NOTIFY_SQL = '''
+        INSERT INTO notify_state (phone, enabled) VALUES (?, ?)
+        ON CONFLICT(phone) DO UPDATE SET enabled = excluded.enabled
+        '''
+NOTIFY_SUBSCRIBERS_SQL = 'SELECT phone, content_hash, subjects FROM notify_state WHERE enabled = 1'
+SAVE_NOTIFY_STATE_SQL = 'UPDATE notify_state SET content_hash = ?, subjects = ? WHERE phone = ?'
+# One row per scheduled-task window that some process has started (prefetch/notify run once across uvicorn workers)
+CREATE_TASK_RUNS_SQL = '''
+        CREATE TABLE IF NOT EXISTS task_runs (
+            name TEXT NOT NULL,
+            window TEXT NOT NULL,
+            claimed_at REAL NOT NULL,
+            PRIMARY KEY (name, window)
+        )
+        '''
+CLAIM_TASK_RUN_SQL = 'INSERT OR IGNORE INTO task_runs (name, window, claimed_at) VALUES (?, ?, ?)'
+PURGE_TASK_RUNS_SQL = 'DELETE FROM task_runs WHERE claimed_at < ?'
+# Claims older than this are of no use to anyone
+TASK_RUN_RETENTION = 7 * 86400
+
+# One persistent connection per thread; the async API runs on a small fixed pool of threads
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite")
+
+def _connect():
+    db = sqlite3.connect(DATABASE_PATH, timeout=10, check_same_thread=False, cached_statements=64)
+    # WAL lets lookups run while a write is in progress
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    with _connections_lock:
+        _connections.append(db)
+    return db
+
 @contextmanager
 def get_db():
-    db = sqlite3.connect('users.db')
+    """This thread's persistent connection (opened on first use)"""
+    db = getattr(_local, 'db', None)
+    if db is None:
+        db = _local.db = _connect()
     try:
         yield db
-    finally:
+    except Exception:
+        db.rollback()
+        raise
+
+def close_db():
+    """Close every pooled connection (on shutdown)"""
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+    for db in connections:
         db.close()
+    _local.__dict__.clear()
+    db_executor.shutdown(wait=False)
 
 def init_db():
     with get_db() as db:
-        db.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            phone TEXT PRIMARY KEY,
-            username TEXT NOT NULL,
-            password TEXT NOT NULL,
-            keyword TEXT NOT NULL
-        )
-        ''')
+        db.execute(CREATE_USERS_SQL)
+        db.execute(CREATE_USERS_VERSION_SQL)
+        db.execute(INIT_USERS_VERSION_SQL)
+        for sql in CREATE_USERS_VERSION_TRIGGERS_SQL:
+            db.execute(sql)
+        db.execute(CREATE_ACTIVITY_SQL)
+        db.execute(CREATE_NOTIFY_SQL)
+        db.execute(CREATE_TASK_RUNS_SQL)
         db.commit()
 
+class KeywordIndex:
+    """In-memory copy of the users table: phone -> (phone, username, password, keyword)
+
+    Loaded at startup and kept coherent by save_user (write-through), so the bot
+    can decide whether a message is anyone's keyword without touching SQLite.
+    Other processes sharing users.db bump ``users_version``; refresh() compares it
+    with the version this copy was loaded at and reloads when they differ.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.version = None
+        self.checked_at = 0.0
+        self._users = {}
+        self._keywords = Counter()
+        self._lock = threading.Lock()
+
+    def load(self):
+        with get_db() as db:
+            # One read transaction, so the rows match the version
+            db.execute('BEGIN')
+            try:
+                version = db.execute(USERS_VERSION_SQL).fetchone()[0]
+                rows = db.execute(ALL_USERS_SQL).fetchall()
+            finally:
+                db.rollback()
+        with self._lock:
+            self._users = {row[0]: row for row in rows}
+            self._keywords = Counter(row[3] for row in rows)
+            self.version = version
+            self.checked_at = time.monotonic()
+            self.loaded = True
+
+    def refresh(self):
+        """Reload if any process changed the users table since this copy was loaded"""
+        with get_db() as db:
+            version = db.execute(USERS_VERSION_SQL).fetchone()[0]
+        self.checked_at = time.monotonic()
+        if version != self.version:
+            self.load()
+
+    def put(self, row, version=None):
+        """Write-through from save_user; ``version`` is users_version right after the write"""
+        with self._lock:
+            if version is not None and self.version is not None and version == self.version + 1:
+                # Ours was the only change since the last load: no reload needed
+                self.version = version
+            previous = self._users.get(row[0])
+            if previous is not None:
+                self._keywords[previous[3]] -= 1
+                if not self._keywords[previous[3]]:
+                    del self._keywords[previous[3]]
+            self._users[row[0]] = row
+            self._keywords[row[3]] += 1
+
+    def is_keyword(self, word):
+        return word in self._keywords
+
+    def get(self, phone):
+        return self._users.get(phone)
+
+    def users(self):
+        with self._lock:
+            return list(self._users.values())
+
+    def __len__(self):
+        return len(self._users)
+
+keyword_index = KeywordIndex()
+
 def save_user(phone, username, password, keyword):
     """Save user credentials - keyword is stored lowercase"""
+    row = (phone, username, password, keyword.lower())
     with get_db() as db:
-        db.execute('''
-        INSERT OR REPLACE INTO users (phone, username, password, keyword)
-        VALUES (?, ?, ?, ?)
-        ''', (phone, username, password, keyword.lower()))
+        db.execute(SAVE_USER_SQL, row)
+        version = db.execute(USERS_VERSION_SQL).fetchone()[0]
         db.commit()
+    keyword_index.put(row, version)
 
 def get_user(phone):
     with get_db() as db:
-        cursor = db.execute('SELECT * FROM users WHERE phone = ?', (phone,))
+        cursor = db.execute(GET_USER_SQL, (phone,))
         return cursor.fetchone()
 
 def get_user_by_keyword(phone, keyword):
     with get_db() as db:
-        cursor = db.execute('SELECT * FROM users WHERE phone = ? AND keyword = ?', 
-                          (phone, keyword))
-        return cursor.fetchone()
\ No newline at end of file
+        cursor = db.execute(GET_USER_BY_KEYWORD_SQL, (phone, keyword))
+        return cursor.fetchone()
+
+def record_activity(phone):
+    """Count a report request by a saved user (used to prefetch the busiest users first)"""
+    with get_db() as db:
+        db.execute(RECORD_ACTIVITY_SQL, (phone, time.time()))
+        db.commit()
+
+def get_activity():
+    """phone -> number of report requests"""
+    with get_db() as db:
+        return dict(db.execute(ACTIVITY_SQL).fetchall())
+
+def set_notify(phone, enabled):
+    """Opt a saved user in or out of change notifications"""
+    with get_db() as db:
+        db.execute(SET_NOTIFY_SQL, (phone, int(enabled)))
+        db.commit()
+
+def get_notify_subscribers():
+    """[(phone, content_hash, subjects_json)] for users with notifications on"""
+    with get_db() as db:
+        return db.execute(NOTIFY_SUBSCRIBERS_SQL).fetchall()
+
+def save_notify_state(phone, content_hash, subjects):
+    """Remember the last report a subscriber was notified about"""
+    with get_db() as db:
+        db.execute(SAVE_NOTIFY_STATE_SQL, (content_hash, subjects, phone))
+        db.commit()
+
+def claim_task_run(name, window):
+    """True for the first process to claim ``window`` of task ``name``; everyone else skips it"""
+    now = time.time()
+    with get_db() as db:
+        db.execute(PURGE_TASK_RUNS_SQL, (now - TASK_RUN_RETENTION,))
+        claimed = db.execute(CLAIM_TASK_RUN_SQL, (name, window, now)).rowcount == 1
+        db.commit()
+    return claimed
+
+# -------------------------------
+# Async API: same queries, run on the DB thread pool so the event loop never blocks
+# -------------------------------
+async def run_db(func, *args):
+    """Run a blocking DB function on the DB thread pool (for other modules' queries too)"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+async def save_user_async(phone, username, password, keyword):
+    await run_db(save_user, phone, username, password, keyword)
+
+async def get_user_async(phone):
+    return await run_db(get_user, phone)
+
+async def get_user_by_keyword_async(phone, keyword):
+    return await run_db(get_user_by_keyword, phone, keyword)
+
+async def record_activity_async(phone):
+    """Best effort: the counts only order prefetching, so a failed write mustn't fail the request"""
+    try:
+        await run_db(record_activity, phone)
+    except Exception as e:
+        logger.warning(f"Failed to record activity for {phone}: {e}")
+
+async def get_activity_async():
+    return await run_db(get_activity)
+
+async def set_notify_async(phone, enabled):
+    await run_db(set_notify, phone, enabled)
+
+async def get_notify_subscribers_async():
+    return await run_db(get_notify_subscribers)
+
+async def save_notify_state_async(phone, content_hash, subjects):
+    await run_db(save_notify_state, phone, content_hash, subjects)
+
+async def claim_task_run_async(name, window):
+    return await run_db(claim_task_run, name, window)
+
+async def load_keyword_index_async():
+    await run_db(keyword_index.load)
+
+async def refresh_keyword_index_async(max_age=0.0):
+    """Pick up users saved by other processes, at most once every ``max_age`` seconds"""
+    if keyword_index.loaded and time.monotonic() - keyword_index.checked_at >= max_age:
+        await run_db(keyword_index.refresh)
+
+async def is_keyword_async(word):
+    """Could ``word`` be someone's keyword? Answered from the index, at most KEYWORD_INDEX_MAX_AGE stale"""
+    if not keyword_index.loaded:
+        return True
+    await refresh_keyword_index_async(KEYWORD_INDEX_MAX_AGE)
+    return keyword_index.is_keyword(word)
+
+async def find_user(phone):
+    """Saved account for a Telegram user, from the keyword index once it is loaded"""
+    if keyword_index.loaded:
+        # Always re-check: another worker may have changed this user's password
+        await refresh_keyword_index_async()
+        return keyword_index.get(phone)
+    return await get_user_async(phone)
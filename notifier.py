@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+import metrics
+from config import NOTIFY_WINDOWS, NOTIFY_CONCURRENCY, ATTENDANCE_THRESHOLD
+from model import keyword_index, get_notify_subscribers_async, save_notify_state_async, refresh_keyword_index_async
+from report_cache import report_cache
+from scheduler import WindowedTask
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(subjects: list) -> str:
+    """Cheap fingerprint of a report's per-subject attended/held counts"""
+    return hashlib.sha1(json.dumps(subjects, sort_keys=True).encode()).hexdigest()
+
+
+def _percentage(present, total):
+    return present / total * 100 if total else 0.0
+
+
+def diff_subjects(old: list, new: list, threshold: float = ATTENDANCE_THRESHOLD) -> dict:
+    """What changed between two reports' ``subjects`` lists
+
+    ``marks`` holds (name, new present, new absent) per subject with new classes;
+    ``crossed`` holds (name, old %, new %) for subjects that moved across the
+    threshold, and ``overall`` is (old %, new %) when the overall figure did.
+    """
+    previous = {s['name']: s for s in old}
+    marks, crossed = [], []
+    for subject in new:
+        before = previous.get(subject['name'], {'present': 0, 'total': 0})
+        held = subject['total'] - before['total']
+        attended = subject['present'] - before['present']
+        if held or attended:
+            marks.append((subject['name'], attended, held - attended))
+        old_pct = _percentage(before['present'], before['total'])
+        new_pct = _percentage(subject['present'], subject['total'])
+        if before['total'] and (old_pct < threshold) != (new_pct < threshold):
+            crossed.append((subject['name'], old_pct, new_pct))
+
+    old_overall = _percentage(sum(s['present'] for s in old), sum(s['total'] for s in old))
+    new_overall = _percentage(sum(s['present'] for s in new), sum(s['total'] for s in new))
+    overall = None
+    if old and (old_overall < threshold) != (new_overall < threshold):
+        overall = (old_overall, new_overall)
+    return {'marks': marks, 'crossed': crossed, 'overall': overall}
+
+
+class Notifier(WindowedTask):
+    """Checks each subscriber once per window and messages them only when their register changed
+
+    ``refresh(username, password)`` returns an awaitable report JSON (app.refresh_report);
+    a report still fresh in the cache (e.g. from the prefetch window) is used instead.
+    ``notify(phone, report, changes)`` delivers the message.
+    """
+
+    name = "notify"
+
+    def __init__(self, refresh, notify, windows=NOTIFY_WINDOWS, concurrency=NOTIFY_CONCURRENCY):
+        super().__init__(windows)
+        self.refresh = refresh
+        self.notify = notify
+        self.concurrency = max(1, concurrency)
+
+    async def run_once(self):
+        await self.check_all()
+
+    async def check_all(self):
+        subscribers = await get_notify_subscribers_async()
+        await refresh_keyword_index_async()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info(f"Checking {len(subscribers)} notification subscribers")
+
+        async def check(row):
+            async with semaphore:
+                try:
+                    await self.check(*row)
+                except Exception as e:
+                    metrics.inc("notify_failed")
+                    logger.warning(f"Notification check for {row[0]} failed: {e}")
+
+        await asyncio.gather(*(check(row) for row in subscribers))
+
+    async def check(self, phone: str, last_hash: str, last_subjects: str):
+        user = keyword_index.get(phone)
+        if user is None:
+            return
+        _, username, password, _ = user
+
+        cached = await report_cache.get_async(username, password)
+        if cached is not None and cached[2]:
+            report_json = cached[0]
+        else:
+            report_json = await self.refresh(username, password)
+        report = json.loads(report_json)
+        if "error" in report:
+            metrics.inc("notify_failed")
+            return
+
+        subjects = report.get("subjects", [])
+        digest = content_hash(subjects)
+        if digest == last_hash:
+            metrics.inc("notify_unchanged")
+            return
+
+        # Only diff per subject once the hash says something moved
+        if last_subjects is not None:
+            changes = diff_subjects(json.loads(last_subjects), subjects)
+            if changes['marks'] or changes['crossed'] or changes['overall']:
+                await self.notify(phone, report, changes)
+                metrics.inc("notify_sent")
+        await save_notify_state_async(phone, digest, json.dumps(subjects))
@@ -0,0 +1,51 @@
+"""Vectorised what-if planning over subjects and upcoming-class scenarios."""
+from config import ATTENDANCE_THRESHOLD, PLAN_MAX_CLASSES
+
+
+def plan_attendance(subjects, max_classes=PLAN_MAX_CLASSES, threshold=ATTENDANCE_THRESHOLD):
+    """Plan every subject for 0..max_classes upcoming classes in one NumPy pass
+
+    ``subjects`` is a list of ``{"name", "present", "total"}`` dicts (the
+    ``subjects`` field of a report). For each subject, plus an "Overall" row,
+    and each scenario n, ``must_attend[n]`` is the fewest of the next n classes
+    that keep the subject at or above ``threshold`` percent, and
+    ``can_skip[n]`` is ``n - must_attend[n]``. Both are None when the
+    threshold can't be reached even by attending all n.
+    """
+    # NumPy is loaded on the first /plan rather than at startup
+    import numpy as np
+
+    bp = round(threshold * 100)
+    if not 0 < bp < 10000:
+        raise ValueError(f"Attendance threshold must be between 0 and 100, got {threshold}")
+    if max_classes < 0:
+        raise ValueError("max_classes must not be negative")
+
+    names = [s["name"] for s in subjects] + ["Overall"]
+    present = np.array([s["present"] for s in subjects], dtype=np.int64)
+    total = np.array([s["total"] for s in subjects], dtype=np.int64)
+    present = np.append(present, present.sum())[:, None]
+    total = np.append(total, total.sum())[:, None]
+    upcoming = np.arange(max_classes + 1, dtype=np.int64)[None, :]
+
+    # Attending a of the next n keeps 100 * (present + a) >= threshold * (total + n);
+    # in basis points that is a >= ceil((bp * (total + n) - 10000 * present) / 10000)
+    must_attend = np.maximum(0, -(-(bp * (total + upcoming) - 10000 * present) // 10000))
+    reachable = must_attend <= upcoming
+    can_skip = upcoming - must_attend
+
+    rows = []
+    for i, name in enumerate(names):
+        rows.append({
+            "name": name,
+            "present": int(present[i, 0]),
+            "total": int(total[i, 0]),
+            "must_attend": [int(v) if ok else None for v, ok in zip(must_attend[i], reachable[i])],
+            "can_skip": [int(v) if ok else None for v, ok in zip(can_skip[i], reachable[i])],
+        })
+    return {
+        "threshold": threshold,
+        "upcoming_classes": upcoming[0].tolist(),
+        "subjects": rows[:-1],
+        "overall": rows[-1],
+    }
@@ -0,0 +1,248 @@
+"""Portal health tracking: latency-based timeouts, a retry budget and a circuit breaker.
+
+Every portal round-trip reports its latency (``timed``) and every scrape its
+outcome (``record_success`` / ``record_failure``). After PORTAL_FAILURE_THRESHOLD
+consecutive failures the circuit opens and scrapes fail fast until, after
+PORTAL_OPEN_SECONDS, a single probe scrape is let through and succeeds. A probe
+that ends without a verdict (cancelled, or failed for a non-portal reason)
+hands its slot back with ``release_probe``; one that hangs is written off after
+JOB_TIMEOUT.
+
+Reports that failed because of the portal carry ``portal_unavailable`` (see
+``portal_error``), so a process that only sees the JSON (the app waiting on
+worker.py through the durable queue) can feed its own breaker.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+from config import (
+    HTTP_TIMEOUT,
+    PAGE_TIMEOUT,
+    JOB_TIMEOUT,
+    PORTAL_TIMEOUT_FACTOR,
+    PORTAL_TIMEOUT_MIN,
+    PORTAL_RETRIES,
+    PORTAL_RETRY_BUDGET,
+    PORTAL_FAILURE_THRESHOLD,
+    PORTAL_OPEN_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Latency samples needed before timeouts are derived from them
+MIN_SAMPLES = 20
+
+
+class PortalUnavailable(Exception):
+    """The circuit is open; ``retry_after`` is when the next probe may run"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("The attendance portal is not responding right now. Please try again in a few minutes.")
+        self.retry_after = retry_after
+
+
+def portal_error(error) -> str:
+    """Error report (from an exception or message) for a scrape the portal failed, not e.g. wrong credentials"""
+    return json.dumps({"error": str(error), "portal_unavailable": True})
+
+
+def is_portal_error(report: dict) -> bool:
+    return bool(report.get("portal_unavailable"))
+
+
+class LatencyTracker:
+    """Sliding window of successful portal round-trip times"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class RetryBudget:
+    """Each first attempt deposits ``ratio`` of a token; each retry spends a whole one
+
+    Caps retries at roughly ``ratio`` of traffic, so retries can't multiply the
+    load on a portal that is already struggling.
+    """
+
+    def __init__(self, ratio: float = PORTAL_RETRY_BUDGET, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = PORTAL_FAILURE_THRESHOLD, open_seconds: float = PORTAL_OPEN_SECONDS,
+                 probe_timeout: float = JOB_TIMEOUT):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def _probe_in_flight(self) -> bool:
+        return self._probing and time.monotonic() - self._probe_started < self.probe_timeout
+
+    def allow(self) -> bool:
+        """Raise PortalUnavailable unless a scrape may go to the portal now
+
+        Returns True if the caller is the half-open probe; it must then end with
+        success(), failure() or release_probe().
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN and self.retry_after() == 0:
+                self.state = HALF_OPEN
+                self._probing = False
+                logger.info("Portal circuit half-open, letting a probe through")
+            if self.state == HALF_OPEN and not self._probe_in_flight():
+                if self._probing:
+                    logger.warning("Portal probe gave no answer in time, letting another through")
+                self._probing = True
+                self._probe_started = time.monotonic()
+                return True
+            metrics.inc("portal_circuit_rejected")
+            raise PortalUnavailable(self.retry_after() or self.open_seconds)
+
+    def release_probe(self):
+        """The probe ended without telling us anything about the portal; let the next caller probe"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # opened_at is already PORTAL_OPEN_SECONDS old, so the next allow() probes again
+                self.state = OPEN
+                self._probing = False
+
+    def is_open(self) -> bool:
+        """True while scrapes would be refused, including while a half-open probe is running"""
+        if self.state == HALF_OPEN:
+            return self._probe_in_flight()
+        return self.state == OPEN and self.retry_after() > 0
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Portal circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                logger.warning(f"Portal circuit open after {self.failures} consecutive failures")
+                metrics.inc("portal_circuit_opened")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class PortalHealth:
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.budget = RetryBudget()
+        self.breaker = CircuitBreaker()
+        self.retries = PORTAL_RETRIES
+        self._circuit_gauge = metrics.Gauge(
+            "portal_circuit_open", "1 while the portal circuit breaker refuses scrapes",
+            fn=lambda: int(self.breaker.state != CLOSED)
+        )
+
+    def timeout(self, ceiling: float) -> float:
+        """Seconds to allow one portal round-trip: p95 x PORTAL_TIMEOUT_FACTOR within [min, ceiling]"""
+        p95 = self.latency.percentile(95)
+        if p95 is None:
+            return ceiling
+        return max(PORTAL_TIMEOUT_MIN, min(ceiling, p95 * PORTAL_TIMEOUT_FACTOR))
+
+    def http_timeout(self) -> float:
+        return self.timeout(HTTP_TIMEOUT)
+
+    def page_timeout(self) -> float:
+        """Playwright timeout in milliseconds"""
+        return self.timeout(PAGE_TIMEOUT / 1000) * 1000
+
+    @contextmanager
+    def timed(self):
+        """Record the latency of one successful portal round-trip"""
+        started = time.perf_counter()
+        yield
+        self.latency.observe(time.perf_counter() - started)
+
+    def before_scrape(self) -> bool:
+        """Raises PortalUnavailable while the circuit is open; True if this scrape is the probe"""
+        probe = self.breaker.allow()
+        self.budget.deposit()
+        return probe
+
+    def record_success(self):
+        self.breaker.success()
+
+    def record_failure(self):
+        metrics.inc("portal_failures")
+        self.breaker.failure()
+
+    def release_probe(self):
+        self.breaker.release_probe()
+
+    def retry_delay(self, attempt: int):
+        """Seconds to back off before retry ``attempt`` (1-based), or None if we shouldn't retry"""
+        if attempt > self.retries or self.breaker.state != CLOSED or not self.budget.withdraw():
+            return None
+        metrics.inc("portal_retries")
+        # Full jitter so retries from many jobs don't line up
+        return random.uniform(0, 0.5 * 2 ** attempt)
+
+    def status(self) -> dict:
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 1) if self.breaker.state == OPEN else 0,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "timeout": round(self.http_timeout(), 2),
+            "retry_tokens": round(self.budget.tokens, 2),
+        }
+
+
+portal_health = PortalHealth()
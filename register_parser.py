@@ -0,0 +1,49 @@
+"""Fast extraction of the academic register page straight from the lxml tree."""
+from lxml import etree
+
+REPORT_DATA_CLASS = "reportData2"
+HEADER_CLASS = "reportHeading2WithBackground"
+CELL_CLASS = "cellBorder"
+
+
+def _has_class(element, name: str) -> bool:
+    classes = element.get("class")
+    return classes is not None and name in classes.split()
+
+
+def _text(element) -> str:
+    return "".join(element.itertext()).strip()
+
+
+def extract_register(html):
+    """Return (student_id, header_dates, rows) from the register page
+
+    ``rows`` holds the stripped text of the ``td.cellBorder`` cells of every
+    ``tr[title]`` row, i.e. the same cells the BeautifulSoup parser selects.
+    The page is walked once with ``iter`` instead of running CSS selectors.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    root = etree.fromstring(html, etree.HTMLParser(encoding="utf-8", remove_comments=True))
+    if root is None:
+        raise ValueError("Empty register page")
+
+    student_id = None
+    dates = None
+    rows = []
+    for tr in root.iter("tr"):
+        if dates is None and _has_class(tr, HEADER_CLASS):
+            dates = [_text(td) for td in tr.iter("td")]
+        if tr.get("title") is not None:
+            rows.append([_text(td) for td in tr.iter("td") if _has_class(td, CELL_CLASS)])
+        if student_id is None:
+            for td in tr.iter("td"):
+                if _has_class(td, REPORT_DATA_CLASS):
+                    student_id = _text(td).replace(":", "").strip()
+                    break
+
+    if student_id is None:
+        raise ValueError("Student ID cell (td.reportData2) not found")
+    if dates is None:
+        raise ValueError("Header row (tr.reportHeading2WithBackground) not found")
+    return student_id, dates, rows
@@ -0,0 +1,131 @@
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from config import REPORT_TTL, REPORT_MAX_STALE, REPORT_CACHE_SIZE
+from model import get_db, db_executor, run_db
+from session_store import credential_digest
+
+logger = logging.getLogger(__name__)
+
+# Latest report per username, shared by every process using the same users.db
+CREATE_REPORTS_SQL = '''
+        CREATE TABLE IF NOT EXISTS reports (
+            username TEXT PRIMARY KEY,
+            report TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            digest TEXT NOT NULL
+        )
+        '''
+CREATE_REPORTS_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS reports_fetched_at ON reports (fetched_at)'
+LOAD_REPORT_SQL = 'SELECT report, fetched_at, digest FROM reports WHERE username = ?'
+SAVE_REPORT_SQL = '''
+        INSERT INTO reports (username, report, fetched_at, digest) VALUES (?, ?, ?, ?)
+        ON CONFLICT(username) DO UPDATE SET report = excluded.report, fetched_at = excluded.fetched_at,
+            digest = excluded.digest
+        WHERE excluded.fetched_at > reports.fetched_at
+        '''
+PURGE_REPORTS_SQL = 'DELETE FROM reports WHERE fetched_at < ?'
+
+
+class ReportCache:
+    """LRU cache of attendance report JSON keyed by username
+
+    A report younger than ``ttl`` is fresh; one younger than ``max_stale`` is
+    stale but still usable while a refresh runs. Only callers with the password
+    that produced the report get it back.
+
+    Reports are also written to the ``reports`` table, and ``get_async`` reads
+    it when this process has nothing fresh, so a report scraped or prefetched by
+    one uvicorn worker is served by all of them.
+    """
+
+    def __init__(self, ttl=REPORT_TTL, max_stale=REPORT_MAX_STALE, max_entries=REPORT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def init(self):
+        with get_db() as db:
+            db.execute(CREATE_REPORTS_SQL)
+            db.execute(CREATE_REPORTS_INDEX_SQL)
+            db.commit()
+
+    def get(self, username: str, password: str):
+        """Return (report_json, fetched_at, is_fresh) or None, from this process's memory only"""
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        report_json, fetched_at, digest = entry
+        age = time.time() - fetched_at
+        if age > self.max_stale:
+            del self._entries[username]
+            return None
+        if not hmac.compare_digest(digest, credential_digest(username, password)):
+            return None
+        self._entries.move_to_end(username)
+        return report_json, fetched_at, age <= self.ttl
+
+    async def get_async(self, username: str, password: str):
+        """get(), checking the shared table when this process has no fresh report"""
+        cached = self.get(username, password)
+        if cached is not None and cached[2]:
+            return cached
+        try:
+            stored = await run_db(self.load, username)
+        except Exception as e:
+            logger.error(f"Failed to read shared report for {username}: {e}")
+            return cached
+        entry = self._entries.get(username)
+        if stored is not None and (entry is None or stored[1] > entry[1]):
+            self._remember(username, stored)
+            return self.get(username, password)
+        return cached
+
+    def put(self, username: str, password: str, report_json: str, fetched_at: float = None):
+        """Store a successful report; error reports are never cached"""
+        if "error" in json.loads(report_json):
+            return
+        entry = (report_json, fetched_at or time.time(), credential_digest(username, password))
+        self._remember(username, entry)
+        # Written behind on the DB pool; callers don't wait for it
+        db_executor.submit(self.save, username, entry)
+
+    def _remember(self, username: str, entry: tuple):
+        self._entries[username] = entry
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self, username: str):
+        """(report_json, fetched_at, digest) from the shared table, or None"""
+        with get_db() as db:
+            return db.execute(LOAD_REPORT_SQL, (username,)).fetchone()
+
+    def save(self, username: str, entry: tuple):
+        try:
+            with get_db() as db:
+                db.execute(SAVE_REPORT_SQL, (username, *entry))
+                db.execute(PURGE_REPORTS_SQL, (time.time() - self.max_stale,))
+                db.commit()
+        except Exception as e:
+            logger.error(f"Failed to share report for {username}: {e}")
+
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def mark_cached(report_json: str, fetched_at: float) -> str:
+    """Tag a cached report with when it was scraped so format_report can say so"""
+    report = json.loads(report_json)
+    report["cached_at"] = fetched_at
+    return json.dumps(report)
+
+
+report_cache = ReportCache()
@@ -0,0 +1,169 @@
+"""Memory governor: RSS of the app and its browser processes, and a memory-sized page gate.
+
+Reads /proc (Linux); elsewhere RSS reads as 0 and the page limit falls back to
+MAX_CONCURRENT_PAGES.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+from config import (
+    MEMORY_PER_PAGE_MB,
+    MEMORY_RESERVE_MB,
+    MAX_CONCURRENT_PAGES,
+    MEMORY_CHECK_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+MB = 2 ** 20
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_rss(pid) -> int:
+    """Resident set size of one process in bytes (0 if it is gone or /proc is unavailable)"""
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def descendants(pid) -> list:
+    """All child processes, recursively (Playwright driver, Chromium and its renderers)"""
+    found, pending = [], [pid]
+    while pending:
+        parent = pending.pop()
+        try:
+            tasks = os.listdir(f"/proc/{parent}/task")
+        except OSError:
+            continue
+        for tid in tasks:
+            try:
+                with open(f"/proc/{parent}/task/{tid}/children") as fh:
+                    children = [int(c) for c in fh.read().split()]
+            except (OSError, ValueError):
+                continue
+            found.extend(children)
+            pending.extend(children)
+    return found
+
+
+def available_memory():
+    """MemAvailable in bytes, or None where /proc/meminfo doesn't exist"""
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class ResourceGovernor:
+    """Samples memory every MEMORY_CHECK_INTERVAL and gates how many pages may be open
+
+    The page limit is the open pages plus however many more fit in available
+    memory above MEMORY_RESERVE_MB, between 1 and MAX_CONCURRENT_PAGES.
+    """
+
+    def __init__(self, per_page_mb=MEMORY_PER_PAGE_MB, reserve_mb=MEMORY_RESERVE_MB,
+                 max_pages=MAX_CONCURRENT_PAGES, interval=MEMORY_CHECK_INTERVAL):
+        self.per_page = per_page_mb * MB
+        self.reserve = reserve_mb * MB
+        self.max_pages = max(1, max_pages)
+        self.interval = interval
+        self.app_rss = 0
+        self.browser_rss = 0
+        self.browser_rss_peak = 0
+        self.available = None
+        self.page_limit = self.max_pages
+        self.active_pages = 0
+        self.waiting = 0
+        self.sampled_at = 0.0
+        self._condition = None
+        self._task = None
+        metrics.Gauge("app_rss_bytes", "Resident memory of the app process", fn=lambda: self.app_rss)
+        metrics.Gauge("browser_rss_bytes", "Resident memory of all browser/driver child processes", fn=lambda: self.browser_rss)
+        metrics.Gauge("page_limit", "Concurrent Playwright pages allowed by available memory", fn=lambda: self.page_limit)
+        metrics.Gauge("pages_waiting", "Scrapes waiting for memory to open a page", fn=lambda: self.waiting)
+
+    def sample(self):
+        pid = os.getpid()
+        self.app_rss = process_rss(pid)
+        self.browser_rss = sum(process_rss(child) for child in descendants(pid))
+        self.browser_rss_peak = max(self.browser_rss_peak, self.browser_rss)
+        self.available = available_memory()
+        if self.available is None:
+            self.page_limit = self.max_pages
+        else:
+            headroom = int(max(0, self.available - self.reserve) // self.per_page)
+            self.page_limit = max(1, min(self.max_pages, self.active_pages + headroom))
+        self.sampled_at = time.monotonic()
+        if self._condition is not None:
+            asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def start(self):
+        if self._task is None:
+            self._condition = asyncio.Condition()
+            self.sample()
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Memory sample failed: {e}")
+
+    @asynccontextmanager
+    async def page_slot(self):
+        """Hold one of the memory-permitted page slots while a page is open"""
+        if self._condition is None:
+            await self.start()
+        if time.monotonic() - self.sampled_at > self.interval:
+            self.sample()
+        async with self._condition:
+            if self.active_pages >= self.page_limit:
+                self.waiting += 1
+                metrics.inc("pages_throttled")
+                try:
+                    await self._condition.wait_for(lambda: self.active_pages < self.page_limit)
+                finally:
+                    self.waiting -= 1
+            self.active_pages += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.active_pages -= 1
+                self._condition.notify()
+
+    def status(self) -> dict:
+        return {
+            "app_rss_mb": round(self.app_rss / MB, 1),
+            "browser_rss_mb": round(self.browser_rss / MB, 1),
+            "browser_rss_peak_mb": round(self.browser_rss_peak / MB, 1),
+            "available_mb": round(self.available / MB, 1) if self.available is not None else None,
+            "page_limit": self.page_limit,
+            "active_pages": self.active_pages,
+            "waiting_pages": self.waiting,
+        }
+
+
+resource_governor = ResourceGovernor()
@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+from abc import ABC, abstractmethod
+import logging
+import random
+
+import metrics
+from config import PREFETCH_WINDOWS, PREFETCH_CONCURRENCY, PREFETCH_JITTER
+from model import keyword_index, get_activity_async, claim_task_run_async, refresh_keyword_index_async
+from report_cache import report_cache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_windows(spec: str):
+    """"16:30-17:30,12:45-13:30" -> [(time(16, 30), time(17, 30)), ...]"""
+    windows = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        start, end = (datetime.time.fromisoformat(t.strip()) for t in part.split("-"))
+        windows.append((start, end))
+    return windows
+
+
+class WindowedTask(ABC):
+    """Runs ``run_once`` once per day in each of the configured local-time windows
+
+    Every app process (e.g. ``uvicorn --workers 4``) runs the task loop, but a
+    window is claimed in the database first, so only one of them does the work.
+    """
+
+    name = "task"
+
+    def __init__(self, windows: str):
+        self.window_spec = windows
+        self.windows = parse_windows(windows)
+        self._done = set()
+
+    def current_window(self, now: datetime.datetime):
+        for start, end in self.windows:
+            if start <= now.time() < end:
+                return start, end
+        return None
+
+    @abstractmethod
+    async def run_once(self):
+        """The work for one window (Prefetcher: refresh reports, Notifier: check for changes)"""
+
+    async def run(self, poll_interval: float = 30):
+        if not self.windows:
+            logger.info(f"{self.name.capitalize()} disabled (no windows configured)")
+            return
+        logger.info(f"{self.name.capitalize()} windows: {self.window_spec}")
+        while True:
+            now = datetime.datetime.now()
+            window = self.current_window(now)
+            if window is not None and (now.date(), window) not in self._done:
+                self._done.add((now.date(), window))
+                try:
+                    start, end = window
+                    if await claim_task_run_async(self.name, f"{now.date()} {start}-{end}"):
+                        await self.run_once()
+                    else:
+                        logger.info(f"{self.name.capitalize()} window {start}-{end} already taken by another process")
+                except Exception as e:
+                    logger.error(f"{self.name.capitalize()} failed: {e}")
+            await asyncio.sleep(poll_interval)
+
+
+class Prefetcher(WindowedTask):
+    """Refreshes saved users' reports during configured windows, busiest users first
+
+    ``refresh(username, password)`` must return an awaitable that completes once
+    the report is scraped and stored in the report cache (app.refresh_report).
+    """
+
+    name = "prefetch"
+
+    def __init__(self, refresh, windows=PREFETCH_WINDOWS, concurrency=PREFETCH_CONCURRENCY, jitter=PREFETCH_JITTER):
+        super().__init__(windows)
+        self.refresh = refresh
+        self.concurrency = max(1, concurrency)
+        self.jitter = jitter
+
+    async def run_once(self):
+        await self.prefetch_all()
+
+    async def prefetch_all(self):
+        activity = await get_activity_async()
+        await refresh_keyword_index_async()
+        users = sorted(keyword_index.users(), key=lambda row: activity.get(row[0], 0), reverse=True)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info(f"Prefetching reports for {len(users)} users")
+
+        async def prefetch(row):
+            _, username, password, _ = row
+            async with semaphore:
+                cached = await report_cache.get_async(username, password)
+                if cached is not None and cached[2]:
+                    metrics.inc("prefetch_skipped_fresh")
+                    return
+                await asyncio.sleep(random.uniform(0, self.jitter))
+                try:
+                    await self.refresh(username, password)
+                    metrics.inc("prefetch_refreshed")
+                except Exception as e:
+                    metrics.inc("prefetch_failed")
+                    logger.warning(f"Prefetch for {username} failed: {e}")
+
+        # Tasks are created in activity order, so the semaphore admits the busiest users first
+        await asyncio.gather(*(prefetch(row) for row in users))
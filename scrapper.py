@@ -1,28 +1,45 @@
 import asyncio
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup, SoupStrainer
+from contextlib import asynccontextmanager
 import logging
+import re
 import time
 import json
 
+
+import metrics
+from browser_pool import browser_pool, context_page
+from resource_governor import resource_governor
+from config import BROWSER_HEADLESS, SCRAPER_ENGINE, ATTENDANCE_THRESHOLD
+from http_engine import http_engine, is_register_page, PortalError, LOGIN_URL, REGISTER_URL
+from session_store import session_store, credential_digest
+from register_parser import extract_register
+from history import history_store
+from portal_health import portal_health, PortalUnavailable, portal_error
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 async def fetch_attendance(page, username, password):
+    # Derived from recent portal latency, so a slow portal fails in seconds rather than PAGE_TIMEOUT
+    timeout = portal_health.page_timeout()
     try:
-        # Navigate to login page
-        await page.goto("https://webprosindia.com/vignanit/Default.aspx")
-        await page.wait_for_load_state("networkidle")
-
-        # Fill login form
-        await page.fill("#txtId2", username)
-        await page.fill("#txtPwd2", password)
-
-        # Execute JavaScript and submit
-        await page.evaluate("encryptJSText(2)")
-        await page.evaluate("setValue(2)")
-        await page.click("#imgBtn2")
-        await page.wait_for_load_state("networkidle", timeout=10000)  # Wait for login response
+        # Navigate to login page; the form is all we need, not every asset
+        with metrics.span("login_page"), portal_health.timed():
+            await page.goto(LOGIN_URL, wait_until="domcontentloaded", timeout=timeout)
+            await page.wait_for_selector("#txtId2", timeout=timeout)
+
+        with metrics.span("login_submit"), portal_health.timed():
+            # Fill login form
+            await page.fill("#txtId2", username)
+            await page.fill("#txtPwd2", password)
+
+            # Execute JavaScript and submit
+            await page.evaluate("encryptJSText(2)")
+            await page.evaluate("setValue(2)")
+            async with page.expect_navigation(wait_until="domcontentloaded", timeout=timeout):
+                await page.click("#imgBtn2")
+            # Wait for login response: the landing page or the error label
+            await page.wait_for_selector("#divscreens, #lblError2", state="attached", timeout=timeout)
 
         # Check for login errors
         error = await page.query_selector("#lblError2")
@@ -43,14 +60,17 @@ async def fetch_attendance(page, username, password):
 
 async def get_attendance_data(page):
     """Extract attendance data from portal"""
+    timeout = portal_health.page_timeout()
     try:
-        # Navigate to attendance page
-        academic_url = "https://webprosindia.com/vignanit/Academics/studentacadamicregister.aspx?scrid=2"
-        await page.goto(academic_url)
-        await page.wait_for_load_state("networkidle")
-
-        # Extract HTML content
-        html = await page.content()
+        # Navigate to attendance page; an expired session shows the login form instead
+        with metrics.span("register_fetch"), portal_health.timed():
+            await page.goto(REGISTER_URL, wait_until="domcontentloaded", timeout=timeout)
+            await page.wait_for_selector(
+                "tr.reportHeading2WithBackground, #txtId2", state="attached", timeout=timeout
+            )
+
+            # Extract HTML content
+            html = await page.content()
         return html, "Data extracted successfully"
 
     except Exception as e:
@@ -59,144 +79,300 @@ async def get_attendance_data(page):
 
 def parse_attendance_data(html):
     """Parse attendance HTML and return formatted data"""
+    try:
+        student_id, dates, rows = extract_register(html)
+        return summarize_register(student_id, dates, rows)
+    except Exception as e:
+        raise Exception(f"Failed to parse attendance data: {str(e)}")
+
+def parse_attendance_data_bs4(html):
+    """Original BeautifulSoup/CSS-selector parser, kept as the reference for bench/bench_parser.py"""
+    # Only the benchmark uses it, so bs4 stays out of the app's startup
+    from bs4 import BeautifulSoup, SoupStrainer
+
     try:
         soup = BeautifulSoup(html, 'lxml', parse_only=SoupStrainer(['tr', 'td']))
 
         # Get student ID
         student_id = soup.select_one('td.reportData2').text.strip().replace(':', '').strip()
 
-        # Get dates and find today's column
+        # Get dates
         header_row = soup.select_one('tr.reportHeading2WithBackground')
         dates = [td.text.strip() for td in header_row.select('td')]
-        today = time.strftime("%d/%m")
-        today_index = next((i for i, date in enumerate(dates) if today in date), None)
-
-        # Process attendance data
-        rows = soup.select('tr[title]')
-        total_present = total_classes = 0
-        todays_attendance = []
-        subject_attendance = []
-
-        for row in rows:
-            cells = row.select('td.cellBorder')
-            if len(cells) >= 2:
-                subject = cells[1].text.strip()
-                attendance = cells[-2].text.strip()
-                percentage = cells[-1].text.strip()
-
-                if attendance != "0/0":
-                    present, total = map(int, attendance.split('/'))
-                    total_present += present
-                    total_classes += total
-
-                    # Process today's status if the column exists
-                    if today_index is not None and today_index < len(cells):
-                        today_text = cells[today_index].text.strip()  # e.g. "A A A" or "A P"
-                        # Get a list of statuses (P or A) from the cell text
-                        statuses = [s for s in today_text.split() if s in ['P', 'A']]
-                        if statuses:
-                            # Join statuses with a space (e.g., "A A A" or "A P")
-                            joined_statuses = " ".join(statuses)
-                            todays_attendance.append(f"{subject}: {joined_statuses}")
-
-                    if percentage != ".00":
-                        subject_attendance.append(f"{subject:.<8} {attendance:<7} {percentage}%")
-
-        # Calculate overall percentage and skippable hours
-        overall_percentage = (total_present / total_classes * 100) if total_classes > 0 else 0
-        skippable_hours = calculate_skippable_hours(total_present, total_classes)
-        required_hours = calculate_required_hours(total_present, total_classes)
-        attendance_status = {
-            'above_threshold': overall_percentage >= 75,
-            'required_hours': required_hours
-        }
-        
-        return {
-            'student_id': student_id,
-            'total_present': total_present,
-            'total_classes': total_classes,
-            'overall_percentage': overall_percentage,
-            'todays_attendance': todays_attendance,
-            'subject_attendance': subject_attendance,
-            'skippable_hours': skippable_hours,
-            'attendance_status': attendance_status
-        }
+
+        rows = [[td.text.strip() for td in row.select('td.cellBorder')] for row in soup.select('tr[title]')]
+        return summarize_register(student_id, dates, rows)
     except Exception as e:
         raise Exception(f"Failed to parse attendance data: {str(e)}")
 
-def calculate_skippable_hours(present, total):
-    """Calculate how many hours can be skipped while maintaining 75%"""
-    current = (present / total * 100)
-    skippable = 0
-    while current >= 75 and total < total + 20:
-        skippable += 1
-        total += 1
-        current = (present / total * 100)
-    return skippable
-
-def calculate_required_hours(present, total):
-    """Calculate how many hours need to be attended to reach 75%"""
-    current = (present / total * 100)
-    if current >= 75:
-        return 0
+# Header cells of class-date columns look like "16/10"
+DATE_PATTERN = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+
+def summarize_register(student_id, dates, rows):
+    """Turn the extracted register cells into the attendance summary dict"""
+    # Find today's column
+    today = time.strftime("%d/%m")
+    today_index = next((i for i, date in enumerate(dates) if today in date), None)
+    # Class-date columns, for the per-day history
+    date_columns = [i for i, date in enumerate(dates) if DATE_PATTERN.search(date)]
+
+    # Process attendance data
+    total_present = total_classes = 0
+    todays_attendance = []
+    subject_attendance = []
+    subjects = []
+    daily = {
+        'dates': [DATE_PATTERN.search(dates[i]).group(0) for i in date_columns],
+        'subjects': [],
+        'present': [],
+        'held': []
+    }
+
+    for cells in rows:
+        if len(cells) >= 2:
+            subject = cells[1]
+            attendance = cells[-2]
+            percentage = cells[-1]
+
+            if attendance != "0/0":
+                present, total = map(int, attendance.split('/'))
+                total_present += present
+                total_classes += total
+                subjects.append({'name': subject, 'present': present, 'total': total})
+
+                # P/A marks per class date, e.g. "P A" -> 1 present out of 2 held
+                marks = [cells[i].split() if i < len(cells) else [] for i in date_columns]
+                daily['subjects'].append(subject)
+                daily['present'].append([m.count('P') for m in marks])
+                daily['held'].append([m.count('P') + m.count('A') for m in marks])
+
+                # Process today's status if the column exists
+                if today_index is not None and today_index < len(cells):
+                    today_text = cells[today_index]  # e.g. "A A A" or "A P"
+                    # Get a list of statuses (P or A) from the cell text
+                    statuses = [s for s in today_text.split() if s in ['P', 'A']]
+                    if statuses:
+                        # Join statuses with a space (e.g., "A A A" or "A P")
+                        joined_statuses = " ".join(statuses)
+                        todays_attendance.append(f"{subject}: {joined_statuses}")
+
+                if percentage != ".00":
+                    subject_attendance.append(f"{subject:.<8} {attendance:<7} {percentage}%")
+
+    # Calculate overall percentage and skippable hours
+    overall_percentage = (total_present / total_classes * 100) if total_classes > 0 else 0
+    skippable_hours = calculate_skippable_hours(total_present, total_classes)
+    required_hours = calculate_required_hours(total_present, total_classes)
+    attendance_status = {
+        'above_threshold': overall_percentage >= ATTENDANCE_THRESHOLD,
+        'required_hours': required_hours
+    }
     
-    required = 0
-    while current < 75:
-        required += 1
-        present += 1
-        current = (present / total) * 100
-        total += 1
-    return required
-
-async def get_attendance_report(username: str, password: str) -> str:
-    try:
-        browser = None
-
-        logging.info(f"Starting attendance check for user {username}")
+    return {
+        'student_id': student_id,
+        'total_present': total_present,
+        'total_classes': total_classes,
+        'overall_percentage': overall_percentage,
+        'todays_attendance': todays_attendance,
+        'subject_attendance': subject_attendance,
+        'subjects': subjects,
+        'skippable_hours': skippable_hours,
+        'attendance_status': attendance_status,
+        'daily': daily
+    }
+
+def _basis_points(threshold):
+    """Threshold percentage as integer hundredths of a percent, so the math stays exact"""
+    bp = round(threshold * 100)
+    if not 0 < bp < 10000:
+        raise ValueError(f"Attendance threshold must be between 0 and 100, got {threshold}")
+    return bp
+
+def calculate_skippable_hours(present, total, threshold=ATTENDANCE_THRESHOLD):
+    """Calculate how many hours can be skipped while maintaining the threshold
+
+    Largest k with present / (total + k) >= threshold%, i.e.
+    k = floor((100 * present - threshold * total) / threshold).
+    """
+    bp = _basis_points(threshold)
+    return max(0, (10000 * present - bp * total) // bp)
+
+def calculate_required_hours(present, total, threshold=ATTENDANCE_THRESHOLD):
+    """Calculate how many hours need to be attended to reach the threshold
+
+    Smallest r with (present + r) / (total + r) >= threshold%, i.e.
+    r = ceil((threshold * total - 100 * present) / (100 - threshold)).
+    """
+    bp = _basis_points(threshold)
+    return max(0, -(-(bp * total - 10000 * present) // (10000 - bp)))
+
+@asynccontextmanager
+async def open_page(storage_state=None):
+    """Borrow a page from the warm browser pool, or launch a one-off browser if it isn't running
+
+    Waits for the memory governor first, so only as many pages are open as memory allows.
+    """
+    async with resource_governor.page_slot():
+        if browser_pool.running:
+            async with browser_pool.page(storage_state=storage_state) as page:
+                yield page
+            return
+
+        from playwright.async_api import async_playwright
 
         async with async_playwright() as p:
             # Launch browser (headless=True for no GUI)
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-
-            # Login with retry
-            success, message = await fetch_attendance(page, username, password)
-            if not success:
-                if "Authentication Failed" in message:
-                    return json.dumps({"error": "Invalid Username or Password"})
-                return json.dumps({"error": message})
-
-            # Get attendance data
+            with metrics.span("browser_launch"):
+                browser = await p.chromium.launch(headless=BROWSER_HEADLESS)
+            try:
+                async with context_page(browser, storage_state) as page:
+                    yield page
+            finally:
+                await browser.close()
+
+def build_report(html: str, username: str = None, password: str = None) -> str:
+    """Parse the academic register page into the JSON report returned to clients
+
+    With a ``username`` the parsed register is also saved as a history snapshot,
+    tagged with the digest of the credentials that fetched it.
+    """
+    with metrics.span("parse"):
+        data = parse_attendance_data(html)
+    logging.info("Data parsed successfully")
+
+    if username:
+        try:
+            history_store.record(username, credential_digest(username, password), data['daily'])
+        except Exception as e:
+            logging.error(f"Failed to record attendance history for {username}: {e}")
+
+    # Format output as JSON
+    response = {
+        "student_id": data['student_id'],
+        "total_present": data['total_present'],
+        "total_classes": data['total_classes'],
+        "overall_percentage": data['overall_percentage'],
+        "todays_attendance": data['todays_attendance'],
+        "subject_attendance": data['subject_attendance'],
+        "subjects": data['subjects'],
+        "skippable_hours": data['skippable_hours'],
+        "attendance_status": data['attendance_status']
+    }
+
+    logging.info(f"Report generated: {len(json.dumps(response))} characters")
+    return json.dumps(response)
+
+def login_error(message: str) -> str:
+    if "Authentication Failed" in message:
+        return json.dumps({"error": "Invalid Username or Password"})
+    return json.dumps({"error": message})
+
+async def get_attendance_report_playwright(username: str, password: str) -> str:
+    storage_state = session_store.get("playwright", username, password)
+    async with open_page(storage_state=storage_state) as page:
+        if storage_state is not None:
+            # Still logged in from a recent check? Go straight to the register page
             html, message = await get_attendance_data(page)
-            logging.info(f"Data extraction: {message}")
-            if not html:
-                return json.dumps({"error": "Failed to fetch attendance data"})
-
-            # Parse and format data
-            data = parse_attendance_data(html)
-            logging.info("Data parsed successfully")
-
-            # Format output as JSON
-            response = {
-                "student_id": data['student_id'],
-                "total_present": data['total_present'],
-                "total_classes": data['total_classes'],
-                "overall_percentage": data['overall_percentage'],
-                "todays_attendance": data['todays_attendance'],
-                "subject_attendance": data['subject_attendance'],
-                "skippable_hours": data['skippable_hours'],
-                "attendance_status": data['attendance_status']
-            }
-
-            logging.info(f"Report generated: {len(json.dumps(response))} characters")
-            return json.dumps(response)
+            if is_register_page(html):
+                logging.info(f"Reused portal session for {username}")
+                return await asyncio.to_thread(build_report, html, username, password)
+            session_store.invalidate("playwright", username)
+
+        success, message = await fetch_attendance(page, username, password)
+        if not success:
+            if message.startswith("❌ Error"):
+                # Timeout or navigation failure: the portal, not the credentials
+                raise PortalError(message)
+            return login_error(message)
+        session_store.put("playwright", username, password, await page.context.storage_state())
+
+        # Get attendance data
+        html, message = await get_attendance_data(page)
+        logging.info(f"Data extraction: {message}")
+        if not html:
+            raise PortalError(message)
+
+        # Parse off the event loop so other users aren't blocked
+        return await asyncio.to_thread(build_report, html, username, password)
+
+async def get_attendance_report_http(username: str, password: str) -> str:
+    """Browserless variant; raises PortalError/aiohttp errors so the caller can fall back"""
+    cookies = session_store.get("http", username, password)
+    async with http_engine.session(cookies) as session:
+        if cookies is not None:
+            html = await http_engine.fetch_register_page(session)
+            if is_register_page(html):
+                logging.info(f"Reused portal session for {username}")
+                return await asyncio.to_thread(build_report, html, username, password)
+            session_store.invalidate("http", username)
+            session.cookie_jar.clear()
+
+        success, message = await http_engine.fetch_attendance(session, username, password)
+        if not success:
+            return login_error(message)
+        session_store.put("http", username, password, http_engine.export_cookies(session))
+
+        html, message = await http_engine.get_attendance_data(session)
+        logging.info(f"Data extraction: {message}")
+        return await asyncio.to_thread(build_report, html, username, password)
+
+def is_portal_failure(error: Exception) -> bool:
+    """True for failures that mean the portal (not the student's credentials) is the problem"""
+    import aiohttp
+    from playwright.async_api import Error as PlaywrightError
+
+    return isinstance(error, (PortalError, aiohttp.ClientError, asyncio.TimeoutError, PlaywrightError))
+
+async def scrape_once(username: str, password: str) -> str:
+    if SCRAPER_ENGINE == "http":
+        import aiohttp
+
+        try:
+            return await get_attendance_report_http(username, password)
+        except (PortalError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"HTTP engine failed for {username}, falling back to Playwright: {e}")
+
+    return await get_attendance_report_playwright(username, password)
 
+async def get_attendance_report(username: str, password: str) -> str:
+    try:
+        logging.info(f"Starting attendance check for user {username} ({SCRAPER_ENGINE} engine)")
+        # Fail fast while the portal circuit is open
+        probe = portal_health.before_scrape()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    report = await scrape_once(username, password)
+                except Exception as e:
+                    # Only the portal's own failures count; a student's odd register page doesn't
+                    if not is_portal_failure(e):
+                        raise
+                    portal_health.record_failure()
+                    settled = True
+                    attempt += 1
+                    delay = portal_health.retry_delay(attempt)
+                    if delay is None:
+                        raise
+                    logging.warning(f"Portal failure for {username} ({e}), retry {attempt} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                portal_health.record_success()
+                settled = True
+                return report
+        finally:
+            # A cancelled probe (or one that failed for other reasons) mustn't keep the circuit half-open
+            if probe and not settled:
+                portal_health.release_probe()
+
+    except PortalUnavailable as e:
+        return portal_error(e)
     except Exception as e:
         logging.error(f"Error in attendance report: {str(e)}")
+        if is_portal_failure(e):
+            return portal_error(e)
         return json.dumps({"error": str(e)})
-    finally:
-        if browser:
-            await browser.close()
 
 if __name__ == "__main__":
     username = "Replace with your username"
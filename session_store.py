@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+import logging
+import time
+from collections import OrderedDict
+
+from config import SESSION_TTL, SESSION_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def credential_digest(username: str, password: str) -> str:
+    return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+
+class SessionStore:
+    """Per-username cache of authenticated portal state (cookies / Playwright storage state)
+
+    Entries are keyed by engine and username, expire after ``ttl`` seconds and are
+    only handed out to callers presenting the same password that created them.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_entries=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, engine: str, username: str, password: str):
+        key = (engine, username)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, digest, state = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        if not hmac.compare_digest(digest, credential_digest(username, password)):
+            # Wrong password: never share the session, but don't evict it either
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return state
+
+    def put(self, engine: str, username: str, password: str, state):
+        key = (engine, username)
+        self._entries[key] = (time.monotonic() + self.ttl, credential_digest(username, password), state)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, engine: str, username: str):
+        if self._entries.pop((engine, username), None) is not None:
+            logger.info(f"Portal session for {username} ({engine}) expired")
+
+    def stats(self):
+        return {"sessions": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+session_store = SessionStore()
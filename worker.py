@@ -0,0 +1,169 @@
+"""Scraper worker: leases jobs from the durable SQLite queue and scrapes them.
+
+Run next to the app when QUEUE_BACKEND=sqlite:
+
+    python worker.py                  # one process, WORKER_CONCURRENCY jobs at a time
+    python worker.py --processes 4    # four such processes (one per core)
+
+SIGTERM/SIGINT stop leasing new jobs and let running ones finish, so deploys
+don't drop work; jobs of a worker that dies are retried once their lease expires.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import metrics
+from config import SCRAPER_ENGINE, JOB_TIMEOUT, JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, WORKER_CONCURRENCY
+from job_queue import job_store
+from model import init_db, close_db
+from history import history_store
+from scrapper import get_attendance_report
+from browser_pool import browser_pool
+from http_engine import http_engine
+from portal_health import portal_error
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of old finished jobs
+PURGE_INTERVAL = 300
+
+
+async def run_job(worker_id: str, job_id: int, username: str, password: str, deadline: float = None):
+    """Scrape one leased job, renewing the lease until it is done or cancelled"""
+    timeout = JOB_TIMEOUT if deadline is None else max(0.1, min(JOB_TIMEOUT, deadline - time.time()))
+    scrape = asyncio.create_task(asyncio.wait_for(get_attendance_report(username, password), timeout=timeout))
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(job_store.heartbeat, job_id, worker_id):
+                # Expired and re-leased elsewhere, or cancelled by the app: stop at once
+                logger.warning(f"{worker_id}: lost the lease on job {job_id}, abandoning it")
+                scrape.cancel()
+                return
+
+    beat = asyncio.create_task(heartbeat())
+    failed = False
+    try:
+        result = await scrape
+        if not isinstance(result, str):
+            result = json.dumps(result)
+    except asyncio.TimeoutError:
+        failed = True
+        result = portal_error("The portal took too long to respond. Please try again.")
+        logger.error(f"{worker_id}: job {job_id} for {username} timed out after {timeout:.0f}s")
+    except asyncio.CancelledError:
+        if beat.done():
+            return  # lease lost; another worker owns the job now
+        raise
+    except Exception as e:
+        failed = True
+        result = json.dumps({"error": str(e)})
+        logger.error(f"{worker_id}: job {job_id} for {username} failed: {e}")
+    finally:
+        beat.cancel()
+    await asyncio.to_thread(job_store.complete, job_id, worker_id, result, failed)
+    metrics.inc("worker_jobs_failed" if failed else "worker_jobs_done")
+
+
+async def lease_loop(worker_id: str, stopping: asyncio.Event):
+    idle = JOB_POLL_INTERVAL
+    while not stopping.is_set():
+        job = await asyncio.to_thread(job_store.lease, worker_id)
+        if job is None:
+            # Back off while the queue is empty, up to a second between polls
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=idle)
+            except asyncio.TimeoutError:
+                pass
+            idle = min(idle * 2, 1.0)
+            continue
+        idle = JOB_POLL_INTERVAL
+        job_id, username = job[:2]
+        try:
+            await run_job(worker_id, *job)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(job_store.release, job_id, worker_id)
+            raise
+        logger.info(f"{worker_id}: finished job {job_id} for {username}")
+
+
+async def purge_loop():
+    while True:
+        try:
+            purged = await asyncio.to_thread(job_store.purge)
+            if purged:
+                logger.info(f"Purged {purged} finished jobs")
+        except Exception as e:
+            logger.error(f"Job purge failed: {e}")
+        await asyncio.sleep(PURGE_INTERVAL)
+
+
+async def main(concurrency: int = WORKER_CONCURRENCY):
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    init_db()
+    history_store.init()
+    job_store.init()
+    if SCRAPER_ENGINE == "http":
+        await http_engine.start()
+    else:
+        await browser_pool.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info(f"Worker {name} scraping up to {concurrency} jobs at once ({SCRAPER_ENGINE} engine)")
+    loops = [asyncio.create_task(lease_loop(f"{name}/{i}", stopping)) for i in range(concurrency)]
+    purger = asyncio.create_task(purge_loop())
+    try:
+        # Returns once stopping is set and every running job has finished
+        await asyncio.gather(*loops)
+    finally:
+        purger.cancel()
+        for task in loops:
+            task.cancel()
+        await asyncio.gather(purger, *loops, return_exceptions=True)
+        await browser_pool.stop()
+        await http_engine.stop()
+        close_db()
+        logger.info(f"Worker {name} stopped")
+
+
+def run_process(concurrency: int):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(main(concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to run (default 1)")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="jobs per process")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process(args.concurrency)
+    else:
+        processes = [
+            multiprocessing.Process(target=run_process, args=(args.concurrency,), name=f"worker-{i}")
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+
+        def forward(signum, _frame):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signum)
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for process in processes:
+            process.join()